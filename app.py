@@ -1,13 +1,23 @@
+import functools
+import logging
+import os
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_daq
+import flask
+import numpy as np
 import psycopg2
-from psycopg2.extensions import AsIs
-
 
-conn = psycopg2.connect(database='covid')
-cur = conn.cursor()
+import cache
+import db
+import figures
+import http_cache
+import metrics
+import regions
+import snapshot
+import transforms
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
@@ -16,175 +26,301 @@ server = app.server
 
 DEFAULT_COUNTRY = '''SELECT id FROM country WHERE name='US';'''
 
-COUNTRIES = '''
-SELECT id, name FROM country WHERE id > 0 ORDER BY name;
-'''
-SUBDIVISIONS = '''
-SELECT DISTINCT id, name FROM subdivision WHERE id > 0 AND country = %s ORDER BY name;
-'''
-COUNTIES = '''
-SELECT id, name FROM county where ID > 0 AND subdivision = %s ORDER BY name;
+# every region and its parent, for the RegionIndex the dropdowns are served from
+REGION_HIERARCHY = '''
+SELECT 'country', id, name, NULL::INT FROM country WHERE id > 0
+UNION ALL
+SELECT 'subdivision', id, name, country FROM subdivision WHERE id > 0
+UNION ALL
+SELECT 'county', id, name, subdivision FROM county WHERE id > 0;
 '''
 
-SELECT_BY_COUNTY_DATA = '''
-SELECT day, positive_cases, deaths, recovered FROM cases WHERE county=%s ORDER BY day;
+# the ETL pre-sums every series by (level, ref_id, day); the world is level 'world', ref_id 0. rows are versioned
+# (see etl.CREATE_ROLLUP_TABLE), and a series is read as of the data version it's cached under
+SELECT_ROLLUP_DATA = '''
+SELECT day, positive_cases AS cases, deaths, recovered
+    FROM cases_rollup
+    WHERE level=%(level)s AND ref_id=%(ref_id)s
+        AND version <= %(version)s AND (retired IS NULL OR retired > %(version)s)
+    ORDER BY day;
 '''
 
-SELECT_BY_SUBDIVISION_DATA = '''
-SELECT day, sum(positive_cases), sum(deaths), sum(recovered)
-    FROM cases WHERE subdivision=%s
-    GROUP BY day
-    ORDER BY day ASC;
+# any number of series in one round trip, for comparisons
+SELECT_ROLLUP_BATCH = '''
+SELECT level, ref_id, day, positive_cases AS cases, deaths, recovered
+    FROM cases_rollup
+    WHERE (level, ref_id) IN (SELECT * FROM unnest(%(levels)s::VARCHAR[], %(ref_ids)s::INT[]))
+        AND version <= %(version)s AND (retired IS NULL OR retired > %(version)s)
+    ORDER BY level, ref_id, day;
 '''
 
-SELECT_BY_COUNTRY_DATA = '''
-SELECT day, sum(positive_cases) as cases, sum(deaths) as deaths, sum(recovered) as recovered
-    FROM cases a INNER JOIN country b on a.country = b.id WHERE b.id = %s
-    GROUP BY day
-    ORDER BY day;
+# the version the ETL has published: it only moves once the new data's been warmed (see warmup.py)
+DATA_VERSION = '''
+SELECT COALESCE(live_version, version) FROM data_version;
 '''
 
-SELECT_WORLD_DATA = '''
-SELECT day, sum(positive_cases) as cases, sum(deaths) as deaths, sum(recovered) as recovered
-    FROM %(table)s
-    GROUP BY day
-    ORDER BY day;
-'''
+db.name_queries(globals())
 
-SELECT_ROLLING_AVERAGE = '''
-SELECT day, sum(positive_cases) AS cases, sum(deaths) AS deaths, sum(recovered) AS recovered
-    FROM %(table)s
-    WHERE ref_id=%(ref_id)s
-    GROUP BY day
-    ORDER BY day;
-'''
+# chart series and dropdown options only change when the ETL bumps the data version, which is checked every
+# COVID_VERSION_CHECK_INTERVAL seconds. entries are keyed on it so a new load never serves older data. with a shared
+# backend (COVID_CACHE_URL=sqlite:///... or redis://...) every worker reads what any of them has already fetched
+data_cache = cache.from_url(
+    os.environ.get('COVID_CACHE_URL', 'memory://'),
+    maxsize=int(os.environ.get('COVID_CACHE_SIZE', 512)),
+    ttl=int(os.environ.get('COVID_CACHE_TTL', 24 * 60 * 60)),
+)
+# right after a load every client opening the page misses on the same series at once; a worker's threads wait on the
+# one fetch already in flight for a key instead of each running it
+in_flight = cache.SingleFlight()
+# the region hierarchy every dropdown and the compare search are served from. it's built once per data version and
+# kept in each worker rather than in data_cache, since it's looked up on every keystroke
+region_indexes = cache.LRUCache(maxsize=2, ttl=int(os.environ.get('COVID_CACHE_TTL', 24 * 60 * 60)))
+
+logger = logging.getLogger(__name__)
+
+# COVID_REQUEST_LOG names a file every series a chart asks for is logged to, for warmup.py --top to read
+request_log = logging.getLogger('covid.requests')
+if os.environ.get('COVID_REQUEST_LOG'):
+    request_log.setLevel(logging.INFO)
+    request_log.addHandler(logging.FileHandler(os.environ['COVID_REQUEST_LOG']))
+# COVID_DATA_SOURCE=snapshot serves everything from the columnar snapshot the ETL writes with --snapshot-dir, and never
+# opens a database connection
+snapshots = None
+if os.environ.get('COVID_DATA_SOURCE', 'database') == 'snapshot':
+    snapshots = snapshot.SnapshotReader(os.environ.get('COVID_SNAPSHOT_DIR', 'snapshots'))
+
+data_version = cache.VersionStamp(
+    snapshots.current_version if snapshots else lambda: db.query(DATA_VERSION)[0][0],
+    interval=int(os.environ.get('COVID_VERSION_CHECK_INTERVAL', 30)),
+    on_change=lambda version: None if data_cache.shared else data_cache.clear(),
+)
+
+
+# COVID_CLIENTSIDE=1 computes plot types in the browser instead of with a callback per switch
+CLIENTSIDE = os.environ.get('COVID_CLIENTSIDE', '0') == '1'
+# days in the moving average behind the smoothed plot types
+MOVING_AVERAGE_WINDOW = int(os.environ.get('COVID_MOVING_AVERAGE_WINDOW', transforms.DEFAULT_WINDOW))
+if MOVING_AVERAGE_WINDOW < 1:
+    raise ValueError('COVID_MOVING_AVERAGE_WINDOW must be at least 1, not {}'.format(MOVING_AVERAGE_WINDOW))
+
+# callbacks whose response is fixed by their inputs and the data version get an ETag and may be kept by browsers,
+# proxies and CDNs for COVID_HTTP_MAX_AGE seconds. a deploy with other code or settings makes new ETags
+http_cache.install(
+    app,
+    version=data_version.get,
+    outputs={
+        'covid-graph.figure', 'series-store.data', 'compare-dropdown.options',
+        '..subdivision-dropdown.options...subdivision-dropdown.value..',
+        '..county-dropdown.options...county-dropdown.value..',
+    },
+    max_age=int(os.environ.get('COVID_HTTP_MAX_AGE', 60)),
+    build=http_cache.fingerprint(
+        [__file__, figures.__file__, transforms.__file__, regions.__file__],
+        dash=dash.__version__, clientside=CLIENTSIDE, window=MOVING_AVERAGE_WINDOW,
+    ),
+)
+
+
+def cache_key(name, *args, version=None):
+    # warmup.py fills the cache for a version before it's live
+    return ':'.join(str(part) for part in (version or data_version.get(), name) + args)
+
+
+def cached(name, fetch, *args, version=None, store=None):
+    store = data_cache if store is None else store
+    key = cache_key(name, *args, version=version)
+    value = store.get(key)
+    metrics.CACHE_REQUESTS.inc(name, 'miss' if value is None else 'hit')
+    if value is None:
+        value, shared = in_flight.do(key, fetch_and_cache, store, key, fetch, *args)
+        if shared:
+            metrics.COALESCED_FETCHES.inc(name)
+    return value
+
+
+def fetch_and_cache(store, key, fetch, *args):
+    value = fetch(*args)
+    store.set(key, value)
+    return value
+
+
+def current_snapshot():
+    return snapshots.get(data_version.get())
+
+
+def fetch_default_country():
+    if snapshots:
+        return current_snapshot().default_country()
+    return db.query(DEFAULT_COUNTRY)[0][0]
 
 
 def get_default_country():
-    cur.execute(DEFAULT_COUNTRY)
-    return cur.fetchone()[0]
-
-
-def prepare_graph(cases):
-    data = [
-        {
-            'cases': cases_day, 
-            'deaths': deaths_day, 
-            'recovered': recovered_day,
-            'day': day, 
-        }
-         for day, cases_day, deaths_day, recovered_day in cases
-    ]
-    return data
+    return cached('default-country', fetch_default_country)
 
 
-def get_rolling_average_data(table_type='country', ref_id=None):
-    tables = {
-        'country': 'view_moving_averages_country',
-        'subdivision': 'view_moving_averages_subdivision',
-        'county': 'view_moving_averages_county',
+def series_columns(cases):
+    # cursor rows to an ISO date list and a float array per metric, once per fetch rather than per callback
+    columns = list(zip(*cases)) or [[]] * (len(figures.METRICS) + 1)
+    return [day.isoformat() for day in columns[0]], {
+        metric: transforms.as_array(values) for metric, values in zip(figures.METRICS, columns[1:])
     }
-    table_name = tables[table_type]
-    cur.execute(SELECT_ROLLING_AVERAGE, {'table': AsIs(table_name), 'ref_id': ref_id})
 
 
-def get_derivative_data(table_type='country', ref_id=None):
-    tables = {
-        'country': 'view_derivative_country',
-        'subdivision': 'view_derivative_subdivision',
-        'county': 'view_derivative_county',
+def fetch_series(level, ref_id, version):
+    if snapshots:
+        return current_snapshot().columns(level, ref_id)
+    return series_columns(db.query(SELECT_ROLLUP_DATA, {'level': level, 'ref_id': ref_id, 'version': version}))
+
+
+def fetch_series_batch(wanted, version):
+    if snapshots:
+        current = current_snapshot()
+        return {region: current.columns(*region) for region in wanted}
+    cases = {region: [] for region in wanted}
+    rows = db.query(SELECT_ROLLUP_BATCH, {
+        'levels': [level for level, _ in wanted], 'ref_ids': [ref_id for _, ref_id in wanted], 'version': version,
+    })
+    for level, ref_id, *row in rows:
+        cases[(level, ref_id)].append(row)
+    return {region: series_columns(region_cases) for region, region_cases in cases.items()}
+
+
+def get_series_batch(wanted, version=None):
+    # the same cache entries as get_series; whatever isn't cached yet comes back in one query
+    version = version or data_version.get()
+    keys = {region: cache_key('columns', *region, version=version) for region in wanted}
+    series = {region: data_cache.get(key) for region, key in keys.items()}
+    missing = [region for region, columns in series.items() if columns is None]
+    metrics.CACHE_REQUESTS.inc('columns', 'hit', amount=len(wanted) - len(missing))
+    metrics.CACHE_REQUESTS.inc('columns', 'miss', amount=len(missing))
+    if missing:
+        flight = tuple(sorted(keys[region] for region in missing))
+        fetched, shared = in_flight.do(flight, fetch_and_cache_batch, missing, keys, version)
+        if shared:
+            metrics.COALESCED_FETCHES.inc('columns')
+        series.update(fetched)
+    return series
+
+
+def fetch_and_cache_batch(wanted, keys, version):
+    fetched = fetch_series_batch(wanted, version)
+    for region, columns in fetched.items():
+        data_cache.set(keys[region], columns)
+    return fetched
+
+
+def get_series(level, ref_id, plot_type):
+    # only the cumulative series is fetched and cached; every plot type is a transform of it
+    request_log.info('series %s:%s', level, ref_id)
+    version = data_version.get()
+    fetch = functools.partial(fetch_series, version=version)
+    days, columns = cached('columns', fetch, level, ref_id, version=version)
+    return days, {
+        metric: transforms.apply(plot_type, values, window=MOVING_AVERAGE_WINDOW) for metric, values in columns.items()
     }
-    table_name = tables[table_type]
-    cur.execute(SELECT_ROLLING_AVERAGE, {'table': AsIs(table_name), 'ref_id': ref_id})
 
 
 def get_country_data(country, plot_type):
     if country == 0:
-        if plot_type == 'moving-average':
-            table_name = 'view_moving_averages_country'
-        elif plot_type == 'derivative':
-            table_name = 'view_derivative_country'
-        else:
-            table_name = 'cases'
-        cur.execute(SELECT_WORLD_DATA, {'table': AsIs(table_name)})
-    elif plot_type == 'moving-average':
-        get_rolling_average_data(table_type='country', ref_id=country)
-    elif plot_type == 'derivative':
-        get_derivative_data(table_type='country', ref_id=country)
-    else:
-        cur.execute(SELECT_BY_COUNTRY_DATA, [country])
-    cases = cur.fetchall()
-    return prepare_graph(cases)
+        return get_series('world', 0, plot_type)
+    return get_series('country', country, plot_type)
+
+
+def fetch_region_index():
+    if snapshots:
+        return regions.RegionIndex(*current_snapshot().hierarchy())
+    return regions.RegionIndex.from_rows(db.query(REGION_HIERARCHY))
+
+
+def get_region_index():
+    return cached('region-index', fetch_region_index, store=region_indexes)
 
 
 def get_subdivisions(country=100):
     choices = [(0, 'None')]
-    cur.execute(SUBDIVISIONS, [country])
-    subdivisions = cur.fetchall()
-    if not subdivisions:
-        subdivisions = []
-    
-    choices.extend(subdivisions)
+    choices.extend(get_region_index().subdivisions(country))
     return [{'label': label, 'value': value} for value, label in choices]
 
 
 def get_counties(subdivision=None):
     choices = [(0, 'None')]
-    cur.execute(COUNTIES, [subdivision])
-    counties = cur.fetchall()
-    if not counties:
-        counties = []
-
-    choices.extend(counties)
+    choices.extend(get_region_index().counties(subdivision))
     return [{'label': label, 'value': value} for value, label in choices]
 
 
 def get_subdivision_data(subdivision, plot_type):
-    if plot_type == 'moving-average':
-        get_rolling_average_data(table_type='subdivision', ref_id=subdivision)    
-    elif plot_type == 'derivative':
-        get_derivative_data(table_type='subdivision', ref_id=subdivision)
-    else:
-        cur.execute(SELECT_BY_SUBDIVISION_DATA, [subdivision])
-    cases = cur.fetchall()
-    return prepare_graph(cases)
+    return get_series('subdivision', subdivision, plot_type)
 
 
 def get_county_data(county, plot_type):
-    if plot_type == 'moving-average':
-        get_rolling_average_data(table_type='county', ref_id=county)
-    elif plot_type == 'derivative':
-        get_derivative_data(table_type='county', ref_id=county)
-    else:
-        cur.execute(SELECT_BY_COUNTY_DATA, [county])
-    cases = cur.fetchall()
-    return prepare_graph(cases)
-
-
-def populate_graph_data(data, axis_type):
-    cases_y = [day['cases'] for day in data]
-    deaths_y = [day['deaths'] for day in data]
-    recovered_y = [day['recovered'] for day in data]
-    x = [day['day'] for day in data]
-    return {
-        'data': [
-                {'x': x, 'y': cases_y, 'type': 'line', 'name': 'Cases'},
-                {'x': x, 'y': deaths_y, 'type': 'line', 'name': 'Deaths'},
-                {'x': x, 'y': recovered_y, 'type': 'line', 'name': 'Recovered'}
-            ],
-        'layout': {
-            'yaxis': {'type': axis_type}
-        }
-    }
+    return get_series('county', county, plot_type)
 
 
 def get_countries():
-    cur.execute(COUNTRIES)
     countries = [
-        {'label': label, 'value': value} for value, label in cur.fetchall()
+        {'label': label, 'value': value} for value, label in get_region_index().countries()
     ]
     countries.extend([{'label': 'World', 'value': 0}])
     return countries
+
+
+def region_label(value):
+    if value == 'world:0':
+        return 'World'
+    return get_region_index().label(*parse_region(value)) or value
+
+
+def search_regions(text, selected=()):
+    # the regions matching what's been typed into the compare dropdown, after the ones already picked (which it
+    # needs the options of to show them)
+    options = [{'label': region_label(value), 'value': value} for value in selected or []]
+    chosen = {option['value'] for option in options}
+    if 'world'.startswith((text or '').strip().lower()) and 'world:0' not in chosen:
+        options.append({'label': 'World', 'value': 'world:0'})
+    options.extend(
+        {'label': label, 'value': '{}:{}'.format(level, ref_id)}
+        for level, ref_id, label in get_region_index().search(text)
+        if '{}:{}'.format(level, ref_id) not in chosen
+    )
+    return options
+
+
+def parse_region(value):
+    level, ref_id = value.split(':')
+    return level, int(ref_id)
+
+
+def comparison_traces(wanted, plot_type, metric):
+    # one trace per region, all on the days any of them has
+    for value in wanted:
+        request_log.info('series %s', value)
+    series = get_series_batch([parse_region(value) for value in wanted])
+    days = sorted(set().union(*(region_days for region_days, _ in series.values())))
+    positions = {day: position for position, day in enumerate(days)}
+    traces = []
+    for value in wanted:
+        region_days, columns = series[parse_region(value)]
+        y = np.full(len(days), np.nan)
+        y[[positions[day] for day in region_days]] = transforms.apply(
+            plot_type, columns[metric], window=MOVING_AVERAGE_WINDOW
+        )
+        traces.append((region_label(value), y))
+    return days, traces
+
+
+def selected_traces(country, subdivision, county, plot_type, compare, metric):
+    # the compared regions' metric, or the three metrics for the region picked in the dropdowns
+    if compare:
+        return comparison_traces(compare, plot_type, metric or 'cases')
+
+    if subdivision:
+        if county:
+            days, columns = get_county_data(county, plot_type)
+        else:
+            days, columns = get_subdivision_data(subdivision, plot_type)
+    else:
+        days, columns = get_country_data(country, plot_type)
+    return days, figures.series_traces(columns)
      
 
 footer = [
@@ -196,118 +332,196 @@ footer = [
     html.A(href='https://plot.ly/dash/', children='Dash.')
 ]
 
-data = get_country_data(get_default_country(), 'linear')
-graph_data = populate_graph_data(data, 'linear')
 app.title = 'COVID-19 Charts'
 
 plot_types = [
     {'value': 'linear', 'label': 'Linear'},
     {'value': 'log', 'label': 'Log'},
-    {'value': 'moving-average', 'label': '3-Day Moving Average'},
-    {'value': 'derivative', 'label': '3-Day Smoothed Discrete Derivative'}
+    {'value': 'moving-average', 'label': '{}-Day Moving Average'.format(MOVING_AVERAGE_WINDOW)},
+    {'value': 'derivative', 'label': '{}-Day Smoothed Discrete Derivative'.format(MOVING_AVERAGE_WINDOW)},
+    {'value': 'growth-rate', 'label': 'Daily Growth Rate (Log Derivative)'},
+    {'value': 'doubling-time', 'label': 'Doubling Time (Days)'},
 ]
 
-app.layout = html.Div(children=[
-    html.H1(children='COVID-19 Cases'),
-    dcc.Dropdown(
-        id='country-dropdown',
-        options=get_countries(),
-        value=get_default_country()
-    ),
-    dcc.Dropdown(
-        id='subdivision-dropdown',
-        options=get_subdivisions(),
-        value=None,
-        placeholder='Province/State (if applicable)'
-    ),
-    dcc.Dropdown(
-        id='county-dropdown',
-        options=get_counties(),
-        value=None,
-        placeholder='County (US only)'
-    ),
-    dcc.Dropdown(
-        id='plot-type-button',
-        options=plot_types,
-        value='linear',
-        placeholder='Plot Type'
-    ),
-    dcc.Graph(
-        id='covid-graph',
-        figure=graph_data
-    ),
-    html.Footer(children=footer)
-])
+metric_options = [
+    {'value': 'cases', 'label': 'Compare Cases'},
+    {'value': 'deaths', 'label': 'Compare Deaths'},
+    {'value': 'recovered', 'label': 'Compare Recovered'},
+]
 
 
+def layout_data():
+    # the country options and default, when the page layout itself is being served. dash also calls serve_layout
+    # while registering callbacks, to check their ids against, and again to validate it before the first request to
+    # any route (/metrics or a static asset included); those copies go without data, so only a page load waits on the
+    # database. if it's down the page is served without them rather than failing
+    if not (flask.has_request_context() and flask.request.path == app.config.routes_pathname_prefix + '_dash-layout'):
+        return [], None
+    try:
+        return get_countries(), get_default_country()
+    except (psycopg2.Error, OSError):
+        logger.exception('serving the layout without the country dropdown')
+        return [], None
+
+
+def serve_layout():
+    # built per page load from cached data, so importing the app (and booting a worker) never touches the database.
+    # the graph and the province/county options are filled in by callbacks, which run on load
+    countries, default_country = layout_data()
+    return html.Div(children=[
+        html.H1(children='COVID-19 Cases'),
+        dcc.Dropdown(
+            id='country-dropdown',
+            options=countries,
+            value=default_country
+        ),
+        dcc.Dropdown(
+            id='subdivision-dropdown',
+            options=[],
+            value=None,
+            placeholder='Province/State (if applicable)'
+        ),
+        dcc.Dropdown(
+            id='county-dropdown',
+            options=[],
+            value=None,
+            placeholder='County (US only)'
+        ),
+        dcc.Dropdown(
+            id='plot-type-button',
+            options=plot_types,
+            value='linear',
+            placeholder='Plot Type'
+        ),
+        dcc.Dropdown(
+            id='compare-dropdown',
+            options=[],
+            value=[],
+            multi=True,
+            placeholder='Compare regions (countries, provinces/states, counties)'
+        ),
+        dcc.Dropdown(
+            id='metric-dropdown',
+            options=metric_options,
+            value='cases',
+            clearable=False
+        ),
+        dcc.Graph(
+            id='covid-graph'
+        ),
+        dcc.Store(id='series-store'),
+        html.Footer(children=footer)
+    ])
+
+
+app.layout = serve_layout
+
+
+AXIS_TYPES = {
+    'linear': 'linear',
+    'log': 'log',
+    'moving-average': 'linear',
+    'derivative': 'linear',
+    'growth-rate': 'linear',
+    'doubling-time': 'linear',
+}
+
+if CLIENTSIDE:
+    # the server sends the cumulative series once per selection; switching plot types is worked out in the browser
+    # (assets/clientside.js) without a request
+    @app.callback(
+        dash.dependencies.Output('series-store', 'data'),
+        [
+            dash.dependencies.Input('country-dropdown', 'value'),
+            dash.dependencies.Input('subdivision-dropdown', 'value'),
+            dash.dependencies.Input('county-dropdown', 'value'),
+            dash.dependencies.Input('compare-dropdown', 'value'),
+            dash.dependencies.Input('metric-dropdown', 'value')
+        ]
+    )
+    def update_series_store(country=None, subdivision=None, county=None, compare=None, metric='cases'):
+        days, traces = selected_traces(country, subdivision, county, 'linear', compare, metric)
+        return {'figure': figures.figure(days, traces, axis_type='linear'), 'window': MOVING_AVERAGE_WINDOW}
+
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='covid', function_name='render_figure'),
+        dash.dependencies.Output('covid-graph', 'figure'),
+        [
+            dash.dependencies.Input('series-store', 'data'),
+            dash.dependencies.Input('plot-type-button', 'value')
+        ],
+        [
+            dash.dependencies.State('covid-graph', 'figure')
+        ]
+    )
+else:
+    @app.callback(
+        dash.dependencies.Output('covid-graph', 'figure'),
+        [
+            dash.dependencies.Input('country-dropdown', 'value'),
+            dash.dependencies.Input('subdivision-dropdown', 'value'),
+            dash.dependencies.Input('county-dropdown', 'value'),
+            dash.dependencies.Input('plot-type-button', 'value'),
+            dash.dependencies.Input('compare-dropdown', 'value'),
+            dash.dependencies.Input('metric-dropdown', 'value')
+        ]
+    )
+    def update_graph(country=None, subdivision=None, county=None, plot_type='linear', compare=None, metric='cases'):
+        days, traces = selected_traces(country, subdivision, county, plot_type, compare, metric)
+        graph_data = figures.figure(days, traces, axis_type=AXIS_TYPES[plot_type])
+        return graph_data
+
+
+# one round trip per pick: the options for the next dropdown down come back with this one's reset, and the reset is
+# only sent when there's something to clear, so a dropdown that's already empty doesn't set off the next callback
 @app.callback(
-    dash.dependencies.Output('covid-graph', 'figure'),
     [
-        dash.dependencies.Input('country-dropdown', 'value'),
-        dash.dependencies.Input('subdivision-dropdown', 'value'),
-        dash.dependencies.Input('county-dropdown', 'value'),
-        dash.dependencies.Input('plot-type-button', 'value')
-    ]
-)
-def update_graph(country=None, subdivision=None, county=None, plot_type='linear'):
-    if subdivision:
-        if county:
-            data = get_county_data(county, plot_type)
-        else:
-            data = get_subdivision_data(subdivision, plot_type)
-    else:
-        data = get_country_data(country, plot_type)
-
-    axis_types = {
-        'linear': 'linear',
-        'log': 'log',
-        'moving-average': 'linear',
-        'derivative': 'linear'
-    }
-    graph_data = populate_graph_data(data, axis_type=axis_types[plot_type])
-    return graph_data
-
-
-@app.callback(
-    dash.dependencies.Output('subdivision-dropdown', 'options'),
+        dash.dependencies.Output('subdivision-dropdown', 'options'),
+        dash.dependencies.Output('subdivision-dropdown', 'value')
+    ],
     [
         dash.dependencies.Input('country-dropdown', 'value')
+    ],
+    [
+        dash.dependencies.State('subdivision-dropdown', 'value')
     ]
 )
-def update_state_dropdown(country=100):
-    values = get_subdivisions(country)
-    return values
+def update_state_dropdown(country=100, subdivision=None):
+    return get_subdivisions(country), None if subdivision else dash.no_update
 
 
 @app.callback(
-    dash.dependencies.Output('county-dropdown', 'options'),
+    [
+        dash.dependencies.Output('county-dropdown', 'options'),
+        dash.dependencies.Output('county-dropdown', 'value')
+    ],
     [
         dash.dependencies.Input('subdivision-dropdown', 'value')
+    ],
+    [
+        dash.dependencies.State('county-dropdown', 'value')
     ]
 )
-def update_county_dropdown(county=0):
-    values = get_counties(county)
-    return values
+def update_county_dropdown(subdivision=0, county=None):
+    return get_counties(subdivision), None if county else dash.no_update
 
 
 @app.callback(
-    dash.dependencies.Output('county-dropdown', 'value'),
+    dash.dependencies.Output('compare-dropdown', 'options'),
     [
-        dash.dependencies.Input('subdivision-dropdown', 'value')
+        dash.dependencies.Input('compare-dropdown', 'search_value')
+    ],
+    [
+        dash.dependencies.State('compare-dropdown', 'value')
     ]
 )
-def reset_county_dropdown(*args, **kwargs):
-    return None
+def update_compare_dropdown(text=None, selected=None):
+    return search_regions(text, selected)
 
 
-@app.callback(
-    dash.dependencies.Output('subdivision-dropdown', 'value'),
-    [
-        dash.dependencies.Input('country-dropdown', 'value')
-    ]
-)
-def reset_state_dropdown(*args, **kwargs):
-    return None
+# callback latency and response sizes, query latency and rows, and cache hits and misses, at /metrics
+metrics.instrument_callbacks(app)
+metrics.install(server)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,102 @@
+// plot types worked out in the browser from the cumulative series app.py puts in series-store (COVID_CLIENTSIDE=1).
+// these follow transforms.py: null is a missing value, and a value that isn't defined comes out null
+
+(function() {
+    var AXIS_TYPES = {'log': 'log'};
+
+    function movingAverage(values, window) {
+        // trailing mean; the first window - 1 days average what there is so far. like transforms.moving_average,
+        // missing days are skipped, and it's NaN only where a window has none
+        var totals = [];
+        var counts = [];
+        var total = 0;
+        var count = 0;
+        return values.map(function(value, day) {
+            if (value !== null && !isNaN(value)) {
+                total += value;
+                count += 1;
+            }
+            totals.push(total);
+            counts.push(count);
+            var sum = day >= window ? total - totals[day - window] : total;
+            var present = day >= window ? count - counts[day - window] : count;
+            return present > 0 ? sum / present : NaN;
+        });
+    }
+
+    function difference(values) {
+        return values.map(function(value, day) {
+            return day === 0 ? NaN : value - values[day - 1];
+        });
+    }
+
+    function derivative(values, window) {
+        return difference(movingAverage(values, window));
+    }
+
+    function logDerivative(values, window) {
+        return difference(movingAverage(values, window).map(function(value) {
+            return value > 0 ? Math.log(value) : NaN;
+        }));
+    }
+
+    function doublingTime(values, window) {
+        return logDerivative(values, window).map(function(rate) {
+            return rate > 0 ? Math.LN2 / rate : NaN;
+        });
+    }
+
+    var TRANSFORMS = {
+        'moving-average': movingAverage,
+        'derivative': derivative,
+        'growth-rate': logDerivative,
+        'doubling-time': doublingTime
+    };
+
+    function transformPresent(transform, values, window) {
+        // compared regions are lined up on the days any of them has, with null where one has none. like
+        // app.comparison_traces, transform the days each region has and leave its gaps null
+        var days = [];
+        var present = [];
+        values.forEach(function(value, day) {
+            if (value !== null) {
+                days.push(day);
+                present.push(value);
+            }
+        });
+        var transformed = transform(present, window);
+        var y = values.map(function() {
+            return null;
+        });
+        days.forEach(function(day, position) {
+            y[day] = transformed[position];
+        });
+        return y;
+    }
+
+    function renderFigure(series, plotType, figure) {
+        if (!series) {
+            return figure;
+        }
+        var transform = TRANSFORMS[plotType];
+        return {
+            data: series.figure.data.map(function(trace) {
+                var y = transform ? transformPresent(transform, trace.y, series.window) : trace.y;
+                return Object.assign({}, trace, {
+                    y: y.map(function(value) {
+                        return value === null || isNaN(value) ? null : value;
+                    })
+                });
+            }),
+            layout: Object.assign({}, series.figure.layout, {
+                yaxis: {type: AXIS_TYPES[plotType] || 'linear'}
+            })
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        covid: {
+            render_figure: renderFigure
+        }
+    });
+})();
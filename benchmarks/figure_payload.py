@@ -0,0 +1,93 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import figures  # noqa: E402
+import transforms  # noqa: E402
+
+
+# per-callback cost of building and encoding the chart figure: the per-day dicts app.py used to cache and split back
+# into lists, against the cached column arrays it uses now. encoding is the PlotlyJSONEncoder dash responds with
+
+
+def cursor_rows(days):
+    # what SELECT_ROLLUP_DATA returns for a region with days of growing counts
+    start = datetime.date(2020, 1, 22)
+    cases = np.cumsum(np.random.RandomState(0).poisson(lam=np.linspace(10, 50000, days)))
+    return [
+        (start + datetime.timedelta(days=day), int(total), int(total * 0.05), int(total * 0.3))
+        for day, total in enumerate(cases)
+    ]
+
+
+def prepare_graph(cases):
+    return [
+        {'cases': cases_day, 'deaths': deaths_day, 'recovered': recovered_day, 'day': day}
+        for day, cases_day, deaths_day, recovered_day in cases
+    ]
+
+
+def populate_graph_data(data, axis_type):
+    cases_y = [day['cases'] for day in data]
+    deaths_y = [day['deaths'] for day in data]
+    recovered_y = [day['recovered'] for day in data]
+    x = [day['day'] for day in data]
+    return {
+        'data': [
+            {'x': x, 'y': cases_y, 'type': 'line', 'name': 'Cases'},
+            {'x': x, 'y': deaths_y, 'type': 'line', 'name': 'Deaths'},
+            {'x': x, 'y': recovered_y, 'type': 'line', 'name': 'Recovered'}
+        ],
+        'layout': {'yaxis': {'type': axis_type}}
+    }
+
+
+def series_columns(cases):
+    # app.series_columns, without importing the app (and its database)
+    columns = list(zip(*cases))
+    return [day.isoformat() for day in columns[0]], {
+        metric: transforms.as_array(values) for metric, values in zip(figures.METRICS, columns[1:])
+    }
+
+
+def encode(figure):
+    return json.dumps(figure, cls=PlotlyJSONEncoder)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time building and encoding one chart figure.')
+    parser.add_argument('--days', type=int, nargs='+', default=[60, 120, 365])
+    parser.add_argument('--number', type=int, default=200, help='callbacks timed per measurement')
+    args = parser.parse_args()
+
+    print('{:>5} {:<28} {:>12} {:>10}'.format('days', 'path', 'us/callback', 'bytes'))
+    for days in args.days:
+        rows = cursor_rows(days)
+        dicts = prepare_graph(rows)
+        day_list, columns = series_columns(rows)
+
+        def transformed(plot_type):
+            return {metric: transforms.apply(plot_type, values) for metric, values in columns.items()}
+
+        paths = [
+            ('per-day dicts', lambda: encode(populate_graph_data(dicts, 'linear'))),
+            ('columns', lambda: encode(figures.figure(day_list, figures.series_traces(columns), 'linear'))),
+            ('columns + moving average', lambda: encode(figures.figure(
+                day_list, figures.series_traces(transformed('moving-average')), 'linear'
+            ))),
+        ]
+        for name, callback in paths:
+            seconds = min(timeit.repeat(callback, number=args.number, repeat=5)) / args.number
+            print('{:>5} {:<28} {:>12.1f} {:>10}'.format(days, name, seconds * 1e6, len(callback())))
+
+
+if __name__ == '__main__':
+    main()
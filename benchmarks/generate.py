@@ -0,0 +1,132 @@
+import argparse
+import csv
+import datetime
+import os
+
+import numpy as np
+
+
+# writes Johns Hopkins shaped time series at any scale, for the benchmarks. the files have the quirks etl.py deals
+# with: a US row in the global files (the US is loaded from its own), countries split into provinces, provinces with
+# no recovered rows and a country total instead (as Canada's are), New York's boroughs, US rows with no county (the
+# cruise ships) and a blank day in the deaths files (as around 3/18). every region's counts are a logistic curve
+# fixed by the seed and its row, so writing more days leaves the earlier ones as they were
+
+START = datetime.date(2020, 1, 22)
+BLANK_DEATHS_DAY = 56  # 3/18
+BOROUGHS = ['New York', 'Queens', 'Kings', 'Bronx', 'Richmond']
+
+GLOBAL_HEADER = ['Province/State', 'Country/Region', 'Lat', 'Long']
+US_HEADER = ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Province_State', 'Country_Region', 'Lat', 'Long_',
+             'Combined_Key']
+
+
+def date_columns(days):
+    return [
+        '{d.month}/{d.day}/{year}'.format(d=day, year=day.year % 100)
+        for day in (START + datetime.timedelta(days=offset) for offset in range(days))
+    ]
+
+
+def curve(seed, row, days, scale):
+    # cumulative counts: a logistic curve with a size, growth rate and midpoint picked per row
+    random = np.random.RandomState([seed, row])
+    size = scale * random.lognormal(0, 1.5)
+    rate = random.uniform(0.05, 0.3)
+    midpoint = random.uniform(30, 120)
+    return np.floor(size / (1 + np.exp(-rate * (np.arange(days) - midpoint)))).astype(int)
+
+
+def global_regions(countries, provinces):
+    # (province, country, whether the recovered file has the province), with every fifth country split into
+    # provinces and every other one of those without recovered rows for them
+    regions = [('', 'US', True)]
+    for country in range(countries):
+        name = 'Country {}'.format(country)
+        if country % 5 == 4:
+            regions.extend(
+                ('Province {}'.format(province), name, country % 10 != 9) for province in range(provinces)
+            )
+        else:
+            regions.append(('', name, True))
+    return regions
+
+
+def us_regions(states, counties):
+    regions = [('New York', borough) for borough in BOROUGHS]
+    regions.extend(('State {}'.format(state), 'County {}'.format(county)) for state in range(states)
+                   for county in range(counties))
+    regions.append(('Grand Princess', ''))
+    return regions
+
+
+def write(path, header, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def counts(values, blank=None):
+    return ['' if day == blank else value for day, value in enumerate(values.tolist())]
+
+
+def generate(directory, countries=180, provinces=10, states=50, counties=60, days=120, seed=0):
+    # returns the number of rows written to the global and US confirmed files
+    os.makedirs(directory, exist_ok=True)
+    dates = date_columns(days)
+
+    def path(kind, source):
+        return os.path.join(directory, 'time_series_covid19_{}_{}.csv'.format(kind, source))
+
+    regions = global_regions(countries, provinces)
+    confirmed, deaths, recovered = [], [], []
+    for row, (province, country, has_recovered) in enumerate(regions):
+        cases = curve(seed, row, days, 20000)
+        key = [province, country, 0.0, 0.0]
+        confirmed.append(key + counts(cases))
+        deaths.append(key + counts(cases // 20, blank=BLANK_DEATHS_DAY))
+        if has_recovered:
+            recovered.append(key + counts(cases // 3))
+    # the country totals standing in for the provinces recovered doesn't have
+    totals = sorted({country for _, country, has_recovered in regions if not has_recovered})
+    for row, country in enumerate(totals, len(regions)):
+        recovered.append(['', country, 0.0, 0.0] + counts(curve(seed, row, days, 20000) // 3))
+    write(path('confirmed', 'global'), GLOBAL_HEADER + dates, confirmed)
+    write(path('deaths', 'global'), GLOBAL_HEADER + dates, deaths)
+    write(path('recovered', 'global'), GLOBAL_HEADER + dates, recovered)
+
+    us = us_regions(states, counties)
+    confirmed, deaths = [], []
+    for row, (state, county) in enumerate(us):
+        cases = curve(seed + 1, row, days, 2000)
+        key = [84000000 + row, 'US', 'USA', 840, 1000 + row, county, state, 'US', 0.0, 0.0,
+               ', '.join(part for part in (county, state, 'US') if part)]
+        confirmed.append(key + counts(cases))
+        deaths.append(key + [100000] + counts(cases // 20, blank=BLANK_DEATHS_DAY))
+    write(path('confirmed', 'US'), US_HEADER + dates, confirmed)
+    write(path('deaths', 'US'), US_HEADER + ['Population'] + dates, deaths)
+    return len(regions), len(us)
+
+
+parser = argparse.ArgumentParser(description='Write Johns Hopkins shaped time series for the benchmarks.')
+parser.add_argument('directory')
+parser.add_argument('--countries', type=int, default=180)
+parser.add_argument('--provinces', type=int, default=10, help='per country split into provinces (every fifth one)')
+parser.add_argument('--states', type=int, default=50)
+parser.add_argument('--counties', type=int, default=60, help='per state')
+parser.add_argument('--days', type=int, default=120)
+parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+    args = parser.parse_args()
+    global_rows, us_rows = generate(
+        args.directory, countries=args.countries, provinces=args.provinces, states=args.states,
+        counties=args.counties, days=args.days, seed=args.seed
+    )
+    print('{} global and {} US regions over {} days in {}'.format(global_rows, us_rows, args.days, args.directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+# how long a fresh worker takes to import the app, and then to serve the first page layout (the first request that
+# needs the database). every run is a new interpreter, like a gunicorn worker without --preload. the app's settings
+# come from the environment as usual; with COVID_DSN pointing nowhere the import should still be quick
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN = '''
+import time
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+try:
+    status = wsgi.app.server.test_client().get('/_dash-layout').status_code
+except Exception as e:
+    status = type(e).__name__
+print(imported - started, time.perf_counter() - imported, status)
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time app startup in fresh interpreters.')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    imports, layouts = [], []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, '-c', RUN], cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout.splitlines()[-1].split()
+        imports.append(float(output[0]))
+        layouts.append(float(output[1]))
+        if output[2] != '200':
+            print('first layout request failed: {}'.format(output[2]))
+
+    print('import:       median {:.3f}s, max {:.3f}s'.format(statistics.median(imports), max(imports)))
+    print('first layout: median {:.3f}s, max {:.3f}s'.format(statistics.median(layouts), max(layouts)))
+
+
+if __name__ == '__main__':
+    main()
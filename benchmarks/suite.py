@@ -0,0 +1,231 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import etl  # noqa: E402
+from benchmarks import generate  # noqa: E402
+
+
+# the ETL and the app's data paths against generated data in a database made for the run and dropped after it, with
+# the results as JSON so that two runs can be diffed. the ETL is timed loading every day and then one more day, the
+# daily load. each data path is timed cold (nothing cached, so it goes to the database) and warm, for every plot type
+
+PLOT_TYPES = ['linear', 'log', 'moving-average', 'derivative', 'growth-rate', 'doubling-time']
+
+# regions the app functions are timed on: the biggest of each level, leaving out the placeholder 0 rows that stand
+# for no subdivision or county
+SAMPLE_REGIONS = '''
+SELECT level, ref_id FROM (
+    SELECT level, ref_id, ROW_NUMBER() OVER (PARTITION BY level ORDER BY SUM(positive_cases) DESC, ref_id) AS rank
+    FROM   cases_rollup
+    WHERE  level IN ('country', 'subdivision', 'county') AND ref_id <> 0 AND retired IS NULL
+    GROUP  BY level, ref_id
+) ranked WHERE rank <= %s ORDER BY level, rank;
+'''
+
+SUBDIVISION_PARENTS = '''
+SELECT county.id, county.subdivision, subdivision.country FROM county
+INNER JOIN subdivision ON county.subdivision = subdivision.id WHERE county.id = %s;
+'''
+
+COUNTRY_OF_SUBDIVISION = '''
+SELECT country FROM subdivision WHERE id = %s;
+'''
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_database(admin_dsn, name):
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    try:
+        conn.cursor().execute('CREATE DATABASE {};'.format(name))
+    finally:
+        conn.close()
+    return psycopg2.extensions.make_dsn(admin_dsn, dbname=name)
+
+
+def drop_database(admin_dsn, name):
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    try:
+        conn.cursor().execute('DROP DATABASE IF EXISTS {};'.format(name))
+    finally:
+        conn.close()
+
+
+def server_version(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute('SHOW server_version;')
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_etl(dsn, source_dir, workers):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):  # stdout may be the results
+        timings = etl.Pipeline(dsn=dsn, source_dir=source_dir, workers=workers).run()
+    return {'total': time.perf_counter() - started, 'stages': dict(timings)}
+
+
+def time_call(call, clear, repeat):
+    # one call after clearing the cache, then repeat calls with it warm
+    clear()
+    started = time.perf_counter()
+    call()
+    cold = time.perf_counter() - started
+    warm = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        warm.append(time.perf_counter() - started)
+    return {'cold': cold, 'warm_median': statistics.median(warm), 'warm_min': min(warm)}
+
+
+def bench_app(dsn, repeat, samples):
+    # the app reads its settings at import, so it's imported once the database is loaded
+    os.environ['COVID_DSN'] = dsn
+    os.environ['COVID_DATA_SOURCE'] = 'database'
+    os.environ['COVID_CACHE_URL'] = 'memory://'
+    os.environ['COVID_CLIENTSIDE'] = '0'
+    os.environ['COVID_VERSION_CHECK_INTERVAL'] = str(24 * 60 * 60)
+    import app
+    import db
+
+    regions = db.query(SAMPLE_REGIONS, [samples])
+    countries = [ref_id for level, ref_id in regions if level == 'country']
+    subdivisions = [ref_id for level, ref_id in regions if level == 'subdivision']
+    counties = [ref_id for level, ref_id in regions if level == 'county']
+    _, county_subdivision, county_country = db.query(SUBDIVISION_PARENTS, [counties[0]])[0]
+    subdivision_country = db.query(COUNTRY_OF_SUBDIVISION, [subdivisions[0]])[0][0]
+    compare = ['world:0'] + ['{}:{}'.format(level, ref_id) for level, ref_id in regions]
+
+    paths = {
+        'get_country_data': lambda plot_type: [app.get_country_data(country, plot_type) for country in countries],
+        'get_subdivision_data': lambda plot_type: [
+            app.get_subdivision_data(subdivision, plot_type) for subdivision in subdivisions
+        ],
+        'get_county_data': lambda plot_type: [app.get_county_data(county, plot_type) for county in counties],
+        'update_graph:country': lambda plot_type: app.update_graph(countries[0], None, None, plot_type),
+        'update_graph:subdivision': lambda plot_type: app.update_graph(
+            subdivision_country, subdivisions[0], None, plot_type
+        ),
+        'update_graph:county': lambda plot_type: app.update_graph(
+            county_country, county_subdivision, counties[0], plot_type
+        ),
+        'update_graph:compare': lambda plot_type: app.update_graph(None, None, None, plot_type, compare, 'cases'),
+    }
+    app.data_version.get()
+    results = {}
+    try:
+        for name, path in paths.items():
+            results[name] = {
+                plot_type: time_call(lambda: path(plot_type), app.data_cache.clear, repeat) for plot_type in PLOT_TYPES
+            }
+            log('{}: {:.1f}ms cold, {:.2f}ms warm (linear)'.format(
+                name, results[name]['linear']['cold'] * 1000, results[name]['linear']['warm_median'] * 1000
+            ))
+    finally:
+        if db._pool is not None:
+            db._pool.closeall()
+    return {'regions': {'countries': countries, 'subdivisions': subdivisions, 'counties': counties}, 'paths': results}
+
+
+parser = argparse.ArgumentParser(description='Benchmark the ETL and the app against generated data.')
+parser.add_argument(
+    '--admin-dsn', default=os.environ.get('COVID_BENCH_ADMIN_DSN', 'dbname=postgres'),
+    help='a database to connect to while creating and dropping the one the benchmark uses (default: postgres)'
+)
+parser.add_argument('--countries', type=int, default=180)
+parser.add_argument('--provinces', type=int, default=10)
+parser.add_argument('--states', type=int, default=50)
+parser.add_argument('--counties', type=int, default=60, help='per state')
+parser.add_argument('--days', type=int, default=120)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='ETL worker processes')
+parser.add_argument('--repeat', type=int, default=20, help='warm calls per data path and plot type')
+parser.add_argument('--samples', type=int, default=3, help='regions per level the data paths are timed on')
+parser.add_argument('--output', '-o', default='-', help='where to write the JSON results (default: stdout)')
+parser.add_argument('--keep', action='store_true', help="don't drop the database or the generated files")
+
+
+def main():
+    args = parser.parse_args()
+    name = 'covid_bench_{}'.format(os.getpid())
+    source_dir = tempfile.mkdtemp(prefix='covid-bench-')
+    scale = {
+        'countries': args.countries, 'provinces': args.provinces, 'states': args.states,
+        'counties': args.counties, 'days': args.days, 'seed': args.seed,
+    }
+    results = {
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scale': scale,
+        'workers': args.workers,
+        'repeat': args.repeat,
+    }
+    dsn = create_database(args.admin_dsn, name)
+    try:
+        results['postgres'] = server_version(dsn)
+
+        log('generating {countries} countries and {states}x{counties} counties over {days} days'.format(**scale))
+        regions = generate.generate(source_dir, **dict(scale, days=args.days - 1))
+        results['regions'] = dict(zip(('global', 'US'), regions))
+        log('etl: loading {} days'.format(args.days - 1))
+        results['etl'] = {'full': run_etl(dsn, source_dir, args.workers)}
+        generate.generate(source_dir, **scale)
+        log('etl: loading one more day')
+        results['etl']['incremental'] = run_etl(dsn, source_dir, args.workers)
+
+        results['app'] = bench_app(dsn, args.repeat, args.samples)
+    finally:
+        if args.keep:
+            log('kept database {} and files in {}'.format(name, source_dir))
+        else:
+            drop_database(args.admin_dsn, name)
+            shutil.rmtree(source_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log('results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+# backends share get(key, default) / set(key, value) / clear(). keys are strings; the shared backends pickle values.
+# shared is True when other workers see the same entries, in which case they needn't clear on a new data version:
+# entries are keyed on it and older ones run out on their ttl
+
+
+class LRUCache:
+    # thread-safe, holds at most maxsize entries (least recently used go first) and each for at most ttl seconds
+    shared = False
+
+    def __init__(self, maxsize=512, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    # a file every worker on the host opens, so they share warm results. holds about maxsize entries; when it grows
+    # past that the ones closest to expiring go first
+    shared = True
+
+    CREATE = 'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL);'
+    PURGE_EVERY = 100
+
+    def __init__(self, path, maxsize=4096, ttl=3600):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._sets = 0
+        self._connect().execute(self.CREATE)
+
+    def _connect(self):
+        # sqlite connections can't cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL;')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=None):
+        row = self._connect().execute(
+            'SELECT value FROM cache WHERE key = ? AND expires > ?;', (key, time.time())
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?);',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + self.ttl)
+        )
+        self._sets += 1
+        if self._sets % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM cache WHERE expires <= ?;', (time.time(),))
+            conn.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY expires LIMIT max((SELECT COUNT(*) FROM cache) - ?, 0));',
+                (self.maxsize,)
+            )
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache;')
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache:
+    # speaks just enough of the Redis protocol (RESP) for GET/SET/SCAN/DEL, so it works against Redis or anything
+    # compatible without another dependency. keys are prefixed, and expire on the server after ttl seconds
+    shared = True
+
+    def __init__(self, host='localhost', port=6379, db=0, ttl=3600, prefix='covid:', timeout=5):
+        self.address = (host, port)
+        self.db = db
+        self.ttl = ttl
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address, timeout=self.timeout)
+        self._file = self._sock.makefile('rb')
+        self._pid = os.getpid()
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = self._file = None
+
+    def _send(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self._sock.sendall(b''.join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('connection closed by the server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            if int(rest) < 0:
+                return None
+            data = self._file.read(int(rest) + 2)
+            return data[:-2]
+        if kind == b'*':
+            return None if int(rest) < 0 else [self._read() for _ in range(int(rest))]
+        raise RedisError('unexpected reply {!r}'.format(line))
+
+    def command(self, *args):
+        with self._lock:
+            # a forked worker gets its own connection; a dropped one is reopened once
+            for attempt in range(2):
+                try:
+                    if self._sock is None or self._pid != os.getpid():
+                        self._connect()
+                    return self._send(*args)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def get(self, key, default=None):
+        value = self.command('GET', self.prefix + key)
+        return default if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self.command('SET', self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 'EX', self.ttl)
+
+    def clear(self):
+        cursor = b'0'
+        while True:
+            cursor, keys = self.command('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+            if keys:
+                self.command('DEL', *keys)
+            if cursor == b'0':
+                break
+
+
+def from_url(url, maxsize=512, ttl=3600):
+    # memory://, sqlite:///path/to/cache.db or redis://host:port/db
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme == 'memory':
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+    if parsed.scheme == 'sqlite':
+        return SQLiteCache(parsed.path, maxsize=maxsize, ttl=ttl)
+    if parsed.scheme == 'redis':
+        return RedisCache(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(parsed.path.strip('/') or 0),
+            ttl=ttl,
+        )
+    raise ValueError('unknown cache backend {!r}'.format(url))
+
+
+class VersionStamp:
+    # the data version the ETL bumps on every load, re-read at most every interval seconds so that checking it
+    # doesn't cost a query per request. on_change is called with the new version when it moves
+    def __init__(self, load, interval=30, on_change=None):
+        self.load = load
+        self.interval = interval
+        self.on_change = on_change
+        self._version = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is None or now - self._checked >= self.interval:
+                version = self.load()
+                self._checked = now
+                if version != self._version and self._version is not None and self.on_change:
+                    self.on_change(version)
+                self._version = version
+            return self._version
+
+
+class SingleFlight:
+    # concurrent calls for the same key share one call: the first runs it and the others wait for its result (or its
+    # exception) instead of running it again. do returns the result and whether it came from another thread's call.
+    # only threads of one process are coalesced; every worker still makes its own call
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = self._calls[key] = {'done': threading.Event(), 'value': None, 'error': None}
+        if shared:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['value'], True
+
+        try:
+            call['value'] = fn(*args)
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['value'], False
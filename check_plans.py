@@ -0,0 +1,65 @@
+import json
+import sys
+
+import psycopg2
+
+import app
+import db
+
+
+SAMPLE_IDS = '''
+SELECT (SELECT id FROM country WHERE name='US'),
+       (SELECT MIN(id) FROM subdivision WHERE id > 0),
+       (SELECT MIN(id) FROM county WHERE id > 0);
+'''
+
+
+def app_queries(country, subdivision, county, version):
+    # every query app.py runs, with parameters for regions that exist
+    yield 'DEFAULT_COUNTRY', app.DEFAULT_COUNTRY, None
+    yield 'REGION_HIERARCHY', app.REGION_HIERARCHY, None
+    for level, ref_id in [('world', 0), ('country', country), ('subdivision', subdivision), ('county', county)]:
+        yield 'SELECT_ROLLUP_DATA ({})'.format(level), app.SELECT_ROLLUP_DATA, {
+            'level': level, 'ref_id': ref_id, 'version': version,
+        }
+    yield 'SELECT_ROLLUP_BATCH', app.SELECT_ROLLUP_BATCH, {
+        'levels': ['world', 'country', 'subdivision', 'county'], 'ref_ids': [0, country, subdivision, county],
+        'version': version,
+    }
+
+
+def seq_scans(plan):
+    if plan['Node Type'] == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+def main():
+    conn = psycopg2.connect(db.dsn())
+    cur = conn.cursor()
+    cur.execute(SAMPLE_IDS)
+    country, subdivision, county = cur.fetchone()
+    cur.execute(app.DATA_VERSION)
+    version = cur.fetchone()[0]
+
+    # with sequential scans priced out the planner only picks one when there's no usable index
+    cur.execute('SET enable_seqscan = off;')
+    failed = False
+    for name, query, params in app_queries(country, subdivision, county, version):
+        cur.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        tables = sorted(set(seq_scans(plan[0]['Plan'])))
+        if tables:
+            failed = True
+            print('FAIL {}: seq scan on {}'.format(name, ', '.join(tables)))
+        else:
+            print('ok   {}'.format(name))
+    conn.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.pool
+
+import metrics
+
+
+POOL_MAX = int(os.environ.get('COVID_DB_POOL_MAX', 10))
+# psycopg2's pools keep at most this many idle connections and close any returned beyond it, so below POOL_MAX
+# concurrent queries open and close connections of their own
+POOL_MIN = int(os.environ.get('COVID_DB_POOL_MIN', POOL_MAX))
+# how many times a query is retried on a fresh connection after the one it had died (say, in a database restart)
+RETRIES = int(os.environ.get('COVID_DB_RETRIES', 1))
+# queries slower than this are logged with their parameters bound; 0 logs none
+SLOW_QUERY_SECONDS = float(os.environ.get('COVID_SLOW_QUERY_MS', 0)) / 1000
+
+logger = logging.getLogger(__name__)
+
+# SQL to the name of the constant holding it, for the metrics
+QUERY_NAMES = {}
+
+_pool = None
+_pool_pid = None
+_slots = None
+_slots_pid = None
+_lock = threading.Lock()
+
+
+class Pool(psycopg2.pool.ThreadedConnectionPool):
+    def discard_idle(self):
+        # closes the connections waiting in the pool. after a database restart they're all dead, but each only
+        # says so once it's used, so the query that finds one dead throws the rest out with it
+        with self._lock:
+            idle, self._pool = self._pool, []
+        for conn in idle:
+            conn.close()
+
+
+def dsn():
+    # read when it's needed rather than at import, so setting COVID_DSN after importing this module still counts
+    return os.environ.get('COVID_DSN', 'dbname=covid')
+
+
+def get_pool():
+    global _pool, _pool_pid
+    # connections inherited through a (gunicorn) fork would share the parent's sockets, so each process makes its own
+    if _pool is None or _pool_pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = Pool(POOL_MIN, POOL_MAX, dsn())
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def get_slots():
+    global _slots, _slots_pid
+    # ThreadedConnectionPool raises when it's empty; threads wait for a connection instead
+    if _slots is None or _slots_pid != os.getpid():
+        with _lock:
+            if _slots is None or _slots_pid != os.getpid():
+                _slots = threading.BoundedSemaphore(POOL_MAX)
+                _slots_pid = os.getpid()
+    return _slots
+
+
+def name_queries(namespace):
+    # names every upper case string in namespace (a module's globals()) that's used as a query after its constant
+    QUERY_NAMES.update((value, name) for name, value in namespace.items() if name.isupper() and isinstance(value, str))
+
+
+def query(sql, params=None):
+    name = QUERY_NAMES.get(sql, 'unnamed')
+    with get_slots():
+        for attempt in range(RETRIES + 1):
+            conn = None
+            started = time.perf_counter()
+            try:
+                # connecting can fail like the query can, and is retried the same way
+                pool = get_pool()
+                conn = pool.getconn()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    rows = cur.fetchall()
+                    bound = cur.query
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # the server went away or the connection broke; throw it and the idle ones out and try again on a
+                # new one
+                metrics.QUERY_ERRORS.inc(name)
+                if conn is not None:
+                    pool.putconn(conn, close=True)
+                    pool.discard_idle()
+                if attempt == RETRIES:
+                    raise
+            except psycopg2.Error:
+                metrics.QUERY_ERRORS.inc(name)
+                if conn is not None:
+                    pool.putconn(conn)
+                raise
+            else:
+                pool.putconn(conn)
+                elapsed = time.perf_counter() - started
+                metrics.QUERY_SECONDS.observe(elapsed, name)
+                metrics.QUERY_ROWS.inc(name, amount=len(rows))
+                if SLOW_QUERY_SECONDS and elapsed >= SLOW_QUERY_SECONDS:
+                    logger.warning(
+                        'slow query %s: %.0fms, %d rows: %s',
+                        name, elapsed * 1000, len(rows), bound.decode(errors='replace')
+                    )
+                return rows
@@ -1,15 +1,49 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import psycopg2
+import psycopg2.extras
 import numpy as np
 
+import metrics
+import snapshot
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
 DataFrame = pd.DataFrame
 
-cases = pd.read_csv('../COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv')
-deaths = pd.read_csv('../COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv')
-recovered = pd.read_csv('../COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv')
+DSN = os.environ.get('COVID_DSN', 'dbname=covid')
+
+# the Johns Hopkins repository's time series, checked out next to this one
+SOURCE_DIR = os.environ.get('COVID_SOURCE_DIR', '../COVID-19/csse_covid_19_data/csse_covid_19_time_series')
+TIME_SERIES_FILE = 'time_series_covid19_{kind}_{source}.csv'
+
+# a run's stage timings and rows, written for node_exporter's textfile collector with --metrics-file once it succeeds
+ETL_METRICS = metrics.Registry()
+STAGE_SECONDS = metrics.Gauge(
+    'covid_etl_stage_seconds', 'How long each stage of the last ETL run took.', ['stage'], registry=ETL_METRICS
+)
+ROWS = metrics.Gauge(
+    'covid_etl_rows', 'Rows the last ETL run loaded from each source.', ['source'], registry=ETL_METRICS
+)
+LAST_SUCCESS = metrics.Gauge(
+    'covid_etl_last_success_timestamp_seconds', 'When the ETL last finished a run.', registry=ETL_METRICS
+)
 
 # dates start here
-dates = cases.columns[4:]
+GLOBAL_DATES_START = 4
+US_DATES_START = 11
 
 
 CREATE_COUNTRY_TABLE = '''
@@ -60,36 +94,36 @@ CREATE_CASES_INDEX = '''
 CREATE INDEX IF NOT EXISTS cases_idx ON cases (day);
 '''
 
-INSERT_COUNTRY = '''
-INSERT INTO country (name) VALUES (%s) ON CONFLICT DO NOTHING;
+INSERT_COUNTRIES = '''
+INSERT INTO country (name) VALUES %s ON CONFLICT DO NOTHING RETURNING id, name;
 '''
 
 INSERT_DUMMY_COUNTRY = '''
 INSERT INTO country (id, name) VALUES (0, null) ON CONFLICT DO NOTHING;
 '''
 
-INSERT_SUBDIVISION = '''
-INSERT INTO subdivision (name, country) VALUES (%s, %s) ON CONFLICT DO NOTHING;
+INSERT_SUBDIVISIONS = '''
+INSERT INTO subdivision (name, country) VALUES %s ON CONFLICT DO NOTHING RETURNING id, name, country;
 '''
 
 INSERT_DUMMY_SUBDIVISION = 'INSERT INTO subdivision (id, name, country) VALUES (0, null, 0) ON CONFLICT DO NOTHING;'
 
-INSERT_COUNTY = '''
-INSERT INTO county (name, subdivision) VALUES (%s, %s) ON CONFLICT DO NOTHING;
+INSERT_COUNTIES = '''
+INSERT INTO county (name, subdivision) VALUES %s ON CONFLICT DO NOTHING RETURNING id, name, subdivision;
 '''
 
 INSERT_DUMMY_COUNTY = 'INSERT INTO county (id, name, subdivision) VALUES (0, null, 0) ON CONFLICT DO NOTHING;'
 
-GET_COUNTRY = '''
-SELECT * FROM country WHERE name = %s;
+GET_COUNTRIES = '''
+SELECT id, name FROM country;
 '''
 
-GET_SUBDIVISION = '''
-SELECT * FROM subdivision WHERE name = %s;
+GET_SUBDIVISIONS = '''
+SELECT id, name, country FROM subdivision;
 '''
 
-GET_COUNTY = '''
-SELECT * FROM county WHERE name = %s AND subdivision = %s;
+GET_COUNTIES = '''
+SELECT id, name, subdivision FROM county;
 '''
 
 INSERT_CASES = '''
@@ -107,6 +141,36 @@ INSERT INTO cases
         recovered = cases.recovered + EXCLUDED.recovered;
 '''
 
+CASES_COLUMNS = ['day', 'country', 'subdivision', 'county', 'positive_cases', 'deaths', 'recovered']
+
+# bulk loads COPY into this and upsert from it in one statement. it's a real table, so that every ETL worker's
+# connection can COPY into it, but unlogged: it's emptied on every run and needn't survive a crash
+CREATE_CASES_STAGING_TABLE = '''
+CREATE UNLOGGED TABLE IF NOT EXISTS cases_staging (
+    day DATE,
+    country INT,
+    subdivision INT,
+    county INT,
+    positive_cases INT,
+    deaths INT,
+    recovered INT
+);
+'''
+
+TRUNCATE_CASES_STAGING = '''
+TRUNCATE cases_staging;
+'''
+
+COPY_CASES_STAGING = '''
+COPY cases_staging (day, country, subdivision, county, positive_cases, deaths, recovered) FROM STDIN WITH CSV;
+'''
+
+INSERT_CASES_FROM_STAGING = '''
+INSERT INTO cases (day, country, subdivision, county, positive_cases, deaths, recovered)
+    SELECT day, country, subdivision, county, positive_cases, deaths, recovered FROM cases_staging
+    ON CONFLICT DO NOTHING;
+'''
+
 TRACKED_DATES_TABLE = '''
 CREATE TABLE IF NOT EXISTS tracked_dates (
     id SERIAL PRIMARY KEY,
@@ -115,8 +179,32 @@ CREATE TABLE IF NOT EXISTS tracked_dates (
 );
 '''
 
-INSERT_TRACKED_DATE = '''
-INSERT INTO tracked_dates (day) VALUES (%s) ON CONFLICT DO NOTHING;
+# the last day loaded from each source file. it's advanced in the same transaction as that day's cases, so a
+# crashed run leaves it pointing at data that is actually there
+WATERMARK_TABLE = '''
+CREATE TABLE IF NOT EXISTS etl_watermark (
+    source VARCHAR(20) PRIMARY KEY,
+    day DATE
+);
+'''
+
+# databases loaded before the watermark existed pick up where tracked_dates left off
+SEED_WATERMARK = '''
+INSERT INTO etl_watermark (source, day) SELECT %s, MAX(day) FROM tracked_dates ON CONFLICT DO NOTHING;
+'''
+
+GET_WATERMARK = '''
+SELECT day FROM etl_watermark WHERE source = %s;
+'''
+
+# the last day both source files have been loaded up to
+GET_COMPLETE_DAY = '''
+SELECT MIN(day) FROM etl_watermark WHERE source IN ('global', 'US');
+'''
+
+ADVANCE_WATERMARK = '''
+INSERT INTO etl_watermark (source, day) VALUES (%s, %s)
+    ON CONFLICT (source) DO UPDATE SET day = GREATEST(etl_watermark.day, EXCLUDED.day);
 '''
 
 # Johns Hopkins currently doesn't track data broken out by borough so delete it...
@@ -148,307 +236,792 @@ WHERE  county.id IN (SELECT county.id
                             AND subdivision.NAME = 'New York'); 
 '''
 
-COUNTRY_MOVING_AVERAGES_VIEW = '''
-CREATE OR REPLACE VIEW view_moving_averages_country AS (SELECT day,
-       Avg(positive_cases)
-         over (
-           PARTITION BY country
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       positive_cases,
-       Avg(deaths)
-         over (
-           PARTITION BY country
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       deaths,
-       Avg(recovered)
-         over (
-           PARTITION BY country
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       recovered,
-       country AS ref_id
-FROM   (SELECT day,
-               SUM(positive_cases) AS positive_cases,
-               SUM(deaths)         AS deaths,
-               SUM(recovered)      AS recovered,
-               country AS country
-        FROM   cases
-        GROUP  BY country, day
-        ORDER  BY country, day) AS cases); 
-'''
-
-SUBDIVISION_MOVING_AVERAGES_VIEW = '''
-CREATE OR REPLACE VIEW view_moving_averages_subdivision AS (SELECT day,
-       Avg(positive_cases)
-         over (
-           PARTITION BY subdivision
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       positive_cases,
-       Avg(deaths)
-         over (
-           PARTITION BY subdivision
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       deaths,
-       Avg(recovered)
-         over (
-           PARTITION BY subdivision
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       recovered,
-       subdivision AS ref_id
-FROM   (SELECT day,
-               SUM(positive_cases) AS positive_cases,
-               SUM(deaths)         AS deaths,
-               SUM(recovered)      AS recovered,
-               subdivision AS subdivision
-        FROM   cases
-        GROUP  BY subdivision, day
-        ORDER  BY subdivision, day) AS cases); 
-'''
-
-COUNTY_MOVING_AVERAGES_VIEW = '''
-CREATE OR REPLACE VIEW view_moving_averages_county AS (SELECT day,
-       Avg(positive_cases)
-         over (
-           PARTITION BY county
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       positive_cases,
-       Avg(deaths)
-         over (
-           PARTITION BY county
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       deaths,
-       Avg(recovered)
-         over (
-           PARTITION BY county
-           ORDER BY day ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) :: INTEGER AS
-       recovered,
-       county AS ref_id
-FROM   (SELECT day,
-               SUM(positive_cases) AS positive_cases,
-               SUM(deaths)         AS deaths,
-               SUM(recovered)      AS recovered,
-               county AS county
-        FROM   cases
-        GROUP  BY county, day
-        ORDER  BY county, day) AS cases); 
-'''
-
-COUNTRY_DERIVATIVE_VIEW = '''
-CREATE OR REPLACE VIEW view_derivative_country AS (SELECT day,
-       positive_cases - lag(positive_cases)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       positive_cases,
-       deaths - lag(deaths)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       deaths,
-       recovered - lag(recovered)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       recovered,
-       ref_id AS ref_id
-    FROM   (SELECT day,
-                SUM(positive_cases) AS positive_cases,
-                SUM(deaths)         AS deaths,
-                SUM(recovered)      AS recovered,
-                ref_id AS ref_id
-            FROM   view_moving_averages_country
-            GROUP  BY ref_id, day) AS cases);
-'''
-
-SUBDIVISION_DERIVATIVE_VIEW = '''
-CREATE OR REPLACE VIEW view_derivative_subdivision AS (SELECT day,
-       positive_cases - lag(positive_cases)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       positive_cases,
-       deaths - lag(deaths)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       deaths,
-       recovered - lag(recovered)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       recovered,
-       ref_id AS ref_id
-FROM   (SELECT day,
-               SUM(positive_cases) AS positive_cases,
-               SUM(deaths)         AS deaths,
-               SUM(recovered)      AS recovered,
-               ref_id AS ref_id
-        FROM   view_moving_averages_subdivision
-        GROUP  BY ref_id, day) AS cases);
-'''
-
-COUNTY_DERIVATIVE_VIEW = '''
-CREATE OR REPLACE VIEW view_derivative_county AS (SELECT day,
-       positive_cases - lag(positive_cases)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       positive_cases,
-       deaths - lag(deaths)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       deaths,
-       recovered - lag(recovered)
-         over (
-           PARTITION BY ref_id
-           ORDER BY day) :: INTEGER AS
-       recovered,
-       ref_id AS ref_id
-FROM   (SELECT day,
-               SUM(positive_cases) AS positive_cases,
-               SUM(deaths)         AS deaths,
-               SUM(recovered)      AS recovered,
-               ref_id AS ref_id
-        FROM   view_moving_averages_county
-        GROUP  BY ref_id, day) AS cases);
-'''
-
-
-conn = psycopg2.connect(database='covid')
-cur = conn.cursor()
-
-cur.execute(CREATE_COUNTRY_TABLE)
-cur.execute(CREATE_SUBDIVISION_TABLE)
-cur.execute(CREATE_SUBDIVISION_INDEX)
-cur.execute(CREATE_COUNTY_TABLE)
-cur.execute(CREATE_COUNTY_INDEX)
-cur.execute(CREATE_COUNTRY_INDEX)
-cur.execute(INSERT_DUMMY_COUNTRY)
-cur.execute(INSERT_DUMMY_SUBDIVISION)
-cur.execute(INSERT_DUMMY_COUNTY)
-cur.execute(CREATE_CASES_TABLE)
-cur.execute(CREATE_CASES_INDEX)
-cur.execute(TRACKED_DATES_TABLE)
-cur.execute(COUNTRY_MOVING_AVERAGES_VIEW)
-cur.execute(SUBDIVISION_MOVING_AVERAGES_VIEW)
-cur.execute(COUNTY_MOVING_AVERAGES_VIEW)
-cur.execute(COUNTRY_DERIVATIVE_VIEW)
-cur.execute(SUBDIVISION_DERIVATIVE_VIEW)
-cur.execute(COUNTY_DERIVATIVE_VIEW)
-conn.commit()
+LEVELS = ['world', 'country', 'subdivision', 'county']
 
+# every series the app charts, pre-summed so a request never aggregates the fact table. the world is ref_id 0.
+# a refresh never changes what an older data version sees: its rows are written with the version it bumps to, and
+# the rows they replace are only marked retired by it. a version sees the rows with version <= it that weren't
+# retired by then, so the app keeps charting the live version unchanged until the new one is published
+CREATE_ROLLUP_TABLE = '''
+CREATE TABLE IF NOT EXISTS cases_rollup (
+    level VARCHAR(12),
+    ref_id INT,
+    day DATE,
+    positive_cases BIGINT,
+    deaths BIGINT,
+    recovered BIGINT,
+    version INT NOT NULL DEFAULT 0,
+    retired INT
+);
+'''
 
-inconsistent_recovered_subdivision_data_countries = set()
+# one pass over cases builds all four levels. only days both sources have loaded are summed: a day only one of them
+# has reached would be missing the other's counts in the world and country totals until the next run
+REFRESH_ROLLUP = '''
+UPDATE cases_rollup SET retired = %(version)s WHERE day >= %(since)s AND retired IS NULL;
+INSERT INTO cases_rollup (level, ref_id, day, positive_cases, deaths, recovered, version)
+SELECT CASE
+           WHEN GROUPING(country) = 0 THEN 'country'
+           WHEN GROUPING(subdivision) = 0 THEN 'subdivision'
+           WHEN GROUPING(county) = 0 THEN 'county'
+           ELSE 'world'
+       END,
+       COALESCE(country, subdivision, county, 0),
+       day,
+       SUM(positive_cases),
+       SUM(deaths),
+       SUM(recovered),
+       %(version)s
+FROM   cases
+WHERE  day >= %(since)s AND day <= %(complete)s
+GROUP  BY GROUPING SETS ((country, day), (subdivision, day), (county, day), (day));
+'''
 
+# rows retired by the live version or before it aren't seen by any version the app can still be serving
+PRUNE_ROLLUP = '''
+DELETE FROM cases_rollup WHERE retired <= (SELECT COALESCE(live_version, version) FROM data_version);
+'''
 
-# on 3/18 there were a bunch of NaN values
-def nan_to_int(val):
-    if val is np.nan:
-        return 0
-    else:
-        return int(val)
+# replaced by the rollup and the tables that used to be derived from it
+DROP_VIEWS = '''
+DROP VIEW IF EXISTS view_derivative_country, view_derivative_subdivision, view_derivative_county;
+DROP VIEW IF EXISTS view_moving_averages_country, view_moving_averages_subdivision, view_moving_averages_county;
+'''
 
+# moving averages and derivatives used to be materialized per level; the app computes them from the rollup now
+DROP_DERIVED_TABLES = ''.join(
+    'DROP TABLE IF EXISTS {}_{};'.format(table, level) for table in ('moving_averages', 'derivative') for level in LEVELS
+)
 
-def insert_ts_row(row, us=False, deaths=deaths, recovered=recovered):
-    if us:
-        province_state = 'Province_State'
-        country_region = 'Country_Region'
-        county_col_head = 'Admin2'
-    else:
-        province_state = 'Province/State'
-        country_region = 'Country/Region'
-        county_col_head = None
-    
-    subdivision = row[province_state]
-    country = row[country_region]
+# bumped whenever the ETL changes what the app serves, so its caches know to let go of older results
+DATA_VERSION_TABLE = '''
+CREATE TABLE IF NOT EXISTS data_version (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version INT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+'''
+
+INSERT_DATA_VERSION = '''
+INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING;
+'''
+
+BUMP_DATA_VERSION = '''
+UPDATE data_version SET version = version + 1, updated_at = now() RETURNING version;
+'''
+
+GET_DATA_VERSION = '''SELECT version FROM data_version;'''
+
+# the app serves live_version, which only catches up with version once the publish stage has run, after the cache
+# has been warmed for it. databases from before it was added start out with the version they had
+ADD_LIVE_VERSION = '''
+ALTER TABLE data_version ADD COLUMN IF NOT EXISTS live_version INT;
+UPDATE data_version SET live_version = version WHERE live_version IS NULL;
+'''
+
+# how far an unfinished run got and what it was loading, so a failed run picks up after the last stage it finished.
+# there's at most one row, and it's removed when a run finishes
+CHECKPOINT_TABLE = '''
+CREATE TABLE IF NOT EXISTS etl_checkpoint (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    stage VARCHAR(20) NOT NULL,
+    state JSON NOT NULL,
+    started_at TIMESTAMP NOT NULL DEFAULT now(),
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+'''
+
+GET_CHECKPOINT = '''
+SELECT stage, state, started_at FROM etl_checkpoint;
+'''
+
+SAVE_CHECKPOINT = '''
+INSERT INTO etl_checkpoint (id, stage, state) VALUES (1, %s, %s)
+    ON CONFLICT (id) DO UPDATE SET stage = EXCLUDED.stage, state = EXCLUDED.state, updated_at = now();
+'''
+
+CLEAR_CHECKPOINT = '''
+DELETE FROM etl_checkpoint;
+'''
+
+COUNT_CASES_STAGING = '''
+SELECT COUNT(*) FROM cases_staging;
+'''
+
+CHART_TABLES = ['cases_rollup']
+
+# sets the visibility map so the covering indexes give index-only scans, and refreshes planner stats
+VACUUM_CHART_TABLES = 'VACUUM ANALYZE {};'.format(', '.join(CHART_TABLES))
+
+# indexes matching the lookups app.py and the ETL actually make, applied to existing databases on every run. the
+# covering indexes (INCLUDE needs PostgreSQL 11) let a chart be an index-only scan once the table's been vacuumed
+MIGRATIONS = [
+    'CREATE INDEX IF NOT EXISTS subdivision_country_idx ON subdivision (country, name);',
+    'CREATE INDEX IF NOT EXISTS county_subdivision_idx ON county (subdivision, name);',
+    # the New York boro deletes find cases by county
+    'CREATE INDEX IF NOT EXISTS cases_county_idx ON cases (county, day);',
+    # rollups from before it was versioned are seen by every version
+    'ALTER TABLE cases_rollup ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 0;',
+    'ALTER TABLE cases_rollup ADD COLUMN IF NOT EXISTS retired INT;',
+    'ALTER TABLE cases_rollup DROP CONSTRAINT IF EXISTS cases_rollup_pkey;',
+    'DROP INDEX IF EXISTS cases_rollup_covering_idx;',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS cases_rollup_version_idx
+        ON cases_rollup (level, ref_id, day, version) INCLUDE (positive_cases, deaths, recovered, retired);''',
+]
+
+
+def create_schema(cur):
+    cur.execute(CREATE_COUNTRY_TABLE)
+    cur.execute(CREATE_SUBDIVISION_TABLE)
+    cur.execute(CREATE_SUBDIVISION_INDEX)
+    cur.execute(CREATE_COUNTY_TABLE)
+    cur.execute(CREATE_COUNTY_INDEX)
+    cur.execute(CREATE_COUNTRY_INDEX)
+    cur.execute(INSERT_DUMMY_COUNTRY)
+    cur.execute(INSERT_DUMMY_SUBDIVISION)
+    cur.execute(INSERT_DUMMY_COUNTY)
+    cur.execute(CREATE_CASES_TABLE)
+    cur.execute(CREATE_CASES_INDEX)
+    cur.execute(TRACKED_DATES_TABLE)
+    cur.execute(WATERMARK_TABLE)
+    cur.execute(SEED_WATERMARK, ['global'])
+    cur.execute(SEED_WATERMARK, ['US'])
+    cur.execute(CREATE_CASES_STAGING_TABLE)
+    cur.execute(DROP_VIEWS)
+    cur.execute(DROP_DERIVED_TABLES)
+    cur.execute(CREATE_ROLLUP_TABLE)
+    cur.execute(DATA_VERSION_TABLE)
+    cur.execute(INSERT_DATA_VERSION)
+    cur.execute(ADD_LIVE_VERSION)
+    cur.execute(CHECKPOINT_TABLE)
+    for migration in MIGRATIONS:
+        cur.execute(migration)
+
+
+inconsistent_recovered_subdivision_data_countries = set()
+
+
+def ts_columns(us=False):
     if us:
-        county = row[county_col_head]
-    else:
-        if country == 'US':
+        return 'Province_State', 'Country_Region', 'Admin2'
+    return 'Province/State', 'Country/Region', None
+
+
+class DimensionResolver:
+    # country/subdivision/county ids held in memory so rows never go to the database to find them.
+    # subdivisions are keyed on (name, country) and counties on (name, subdivision), matching the UNIQUE constraints
+    def __init__(self, cur):
+        self.cur = cur
+        cur.execute(GET_COUNTRIES)
+        self.countries = {name: country_id for country_id, name in cur.fetchall()}
+        cur.execute(GET_SUBDIVISIONS)
+        self.subdivisions = {(name, country): subdivision_id for subdivision_id, name, country in cur.fetchall()}
+        cur.execute(GET_COUNTIES)
+        self.counties = {(name, subdivision): county_id for county_id, name, subdivision in cur.fetchall()}
+
+    def _insert(self, insert, select, ids, keys, to_key):
+        missing = sorted(key for key in set(keys) if key not in ids)
+        if not missing:
             return
-        county = None
+        values = [key if isinstance(key, tuple) else (key,) for key in missing]
+        for row in psycopg2.extras.execute_values(self.cur, insert, values, fetch=True):
+            ids[to_key(row)] = row[0]
+        if any(key not in ids for key in missing):
+            # someone else inserted it first, so RETURNING skipped it
+            self.cur.execute(select)
+            ids.update((to_key(row), row[0]) for row in self.cur.fetchall())
+
+    def resolve(self, cases, us=False):
+        province_state, country_region, county_col_head = ts_columns(us)
+        cases = cases[ts_keys(us)].astype(object)  # streamed chunks hold the names as categoricals
+        self._insert(INSERT_COUNTRIES, GET_COUNTRIES, self.countries, cases[country_region], lambda row: row[1])
+        country_ids = cases[country_region].map(self.countries)
+
+        has_subdivision = cases[province_state].notnull()
+        subdivisions = list(zip(cases.loc[has_subdivision, province_state].str.strip(), country_ids[has_subdivision]))
+        self._insert(INSERT_SUBDIVISIONS, GET_SUBDIVISIONS, self.subdivisions, subdivisions, lambda row: row[1:])
+        subdivision_ids = np.zeros(len(cases), dtype=int)  # dummy subdivision for unique constraint
+        subdivision_ids[has_subdivision.values] = [self.subdivisions[subdivision] for subdivision in subdivisions]
+
+        county_ids = np.zeros(len(cases), dtype=int)
+        if us:
+            has_county = has_subdivision & cases[county_col_head].notnull()
+            counties = list(zip(cases.loc[has_county, county_col_head], subdivision_ids[has_county.values].tolist()))
+            self._insert(INSERT_COUNTIES, GET_COUNTIES, self.counties, counties, lambda row: row[1:])
+            county_ids[has_county.values] = [self.counties[county] for county in counties]
+
+        return DataFrame(
+            {'country': country_ids, 'subdivision': subdivision_ids, 'county': county_ids}, index=cases.index
+        )
+
+
+# deaths and recovered rows are matched to cases on these columns. merge treats NaN keys as equal, so a row with no
+# Province/State lines up with the other file's country-level row
+def ts_keys(us=False):
+    province_state, country_region, county_col_head = ts_columns(us)
+    return [country_region, province_state, county_col_head] if us else [country_region, province_state]
+
+
+# JHU doesn't publish recovered data for the US files or for some subdivisions (e.g. Canadian provinces) -- those
+# rows are loaded with this instead of being left out. missing deaths (the NaN days around 3/18) are loaded as 0 too
+RECOVERED_FILL_VALUE = 0
+DEATHS_FILL_VALUE = 0
+
+
+def parse_date(date):
+    return datetime.datetime.strptime(date, '%m/%d/%y').date()
+
 
-    if not isinstance(subdivision, float):
-        deaths_df = deaths.loc[(deaths[province_state] == subdivision) & (deaths[country_region] == country)]
-        if isinstance(recovered, DataFrame):
-            recovered_df = recovered.loc[(recovered[province_state] == subdivision) & (recovered[country_region] == country)]
-        cur.execute(INSERT_COUNTRY, (country,))
-        subdivision = subdivision.strip()
+def counts(frame):
+    # nullable Int32 columns (streamed files) come out as floats with NaN, like the default float64 ones
+    return frame.astype('float64').values
 
+
+def align(cases, other, dates, us=False):
+    # left join on the key columns keeps the cases row order, so the result lines up with cases cell for cell.
+    # only the first of any duplicate keys is used
+    keys = ts_keys(us)
+    other = other.drop_duplicates(keys).reindex(columns=keys + list(dates))
+    return counts(cases[keys].merge(other, on=keys, how='left')[dates])
+
+
+def long_form_cases(cases, ids, deaths, recovered, dates, us=False):
+    # melt the wide files into one row per (region, day), with deaths and recovered aligned in a single pass
+    positive_cases = counts(cases[dates]).ravel()
+    deaths_values = align(cases, deaths, dates, us=us).ravel()
+    if isinstance(recovered, DataFrame):
+        recovered_values = align(cases, recovered, dates, us=us).ravel()
+    else:
+        recovered_values = np.full(len(positive_cases), np.nan)
+
+    long_form = DataFrame({
+        'day': np.tile(pd.to_datetime(dates, format='%m/%d/%y'), len(cases)),
+        'country': np.repeat(ids['country'].values, len(dates)),
+        'subdivision': np.repeat(ids['subdivision'].values, len(dates)),
+        'county': np.repeat(ids['county'].values, len(dates)),
+        'positive_cases': positive_cases,
+        'deaths': deaths_values,
+        'recovered': recovered_values,
+    }, columns=CASES_COLUMNS)
+    long_form = long_form.loc[long_form['positive_cases'].notnull()]  # no data for this day (yet?)
+    return long_form.fillna({'deaths': DEATHS_FILL_VALUE, 'recovered': RECOVERED_FILL_VALUE}).astype({
+        'positive_cases': int, 'deaths': int, 'recovered': int,
+    })
+
+
+def insert_cases(conn, long_form):
+    cur = conn.cursor()
+    for record in long_form.itertuples(index=False):
+        cur.execute(INSERT_CASES, record)
         conn.commit()
-        cur.execute(GET_COUNTRY, [country])
-        country_id, _ = cur.fetchone()
+    return len(long_form)
+
+
+def time_series_path(kind, us=False, source_dir=SOURCE_DIR):
+    return os.path.join(source_dir, TIME_SERIES_FILE.format(kind=kind, source=source_name(us)))
+
+
+def read_time_series(kind, us=False, dates=None, source_dir=SOURCE_DIR, rows=None):
+    path = time_series_path(kind, us=us, source_dir=source_dir)
+    if dates is None:
+        return pd.read_csv(path, nrows=0)  # just the header
+    # only parse the key columns and the days we're going to load
+    wanted = set(ts_keys(us)) | set(dates)
+    if rows is None:
+        return pd.read_csv(path, usecols=lambda column: column in wanted)
+    # or just the rows [start, stop), indexed as they would be in the whole file. the rows before start are skipped
+    # without being split into fields, and the parser stops at stop. a key column can be empty all through a range,
+    # which would make it a float column that won't merge with the others
+    start, stop = rows
+    frame = pd.read_csv(
+        path, usecols=lambda column: column in wanted, dtype={key: object for key in ts_keys(us)},
+        skiprows=range(1, start + 1), nrows=stop - start
+    )
+    frame.index = pd.RangeIndex(start, start + len(frame))
+    return frame
+
+
+# streamed files are read this many rows at a time, with narrow types: the key columns repeat a few names over and
+# over, and counts fit in 32 bits (nullable, since JHU leaves some days empty)
+STREAM_CHUNK_ROWS = 1000
+KEY_DTYPE = 'category'
+COUNT_DTYPE = 'Int32'
+
+
+def read_time_series_chunks(kind, us=False, dates=(), chunksize=STREAM_CHUNK_ROWS, source_dir=SOURCE_DIR):
+    path = time_series_path(kind, us=us, source_dir=source_dir)
+    keys = ts_keys(us)
+    wanted = set(keys) | set(dates)
+    dtype = dict({key: KEY_DTYPE for key in keys}, **{date: COUNT_DTYPE for date in dates})
+    return pd.read_csv(path, usecols=lambda column: column in wanted, dtype=dtype, chunksize=chunksize)
+
+
+def without_us(cases, us):
+    if us:
+        return cases
+    return cases.loc[cases['Country/Region'] != 'US']  # the US comes from its own, per-county file
+
+
+def read_cases(us=False, dates=(), source_dir=SOURCE_DIR, rows=None):
+    return without_us(read_time_series('confirmed', us=us, dates=dates, source_dir=source_dir, rows=rows), us)
+
+
+def source_name(us=False):
+    return 'US' if us else 'global'
+
+
+def get_new_dates(cur, us=False, full=False, source_dir=SOURCE_DIR):
+    # the high-water mark is read once per source; only date columns after it are loaded
+    header = read_time_series('confirmed', us=us, source_dir=source_dir).columns
+    dates = list(header[US_DATES_START if us else GLOBAL_DATES_START:])
+    if full:
+        return dates
+    cur.execute(GET_WATERMARK, [source_name(us)])
+    row = cur.fetchone()
+    watermark = row[0] if row else None
+    if watermark is None:
+        return dates
+    return [date for date in dates if parse_date(date) > watermark]
+
+
+def read_matching(kind, cases, us=False, dates=(), source_dir=SOURCE_DIR, rows=None):
+    # the deaths or recovered rows for some rows of cases: the same range of the other file when it lists the regions
+    # in the same order, as JHU's US files do, or else all of it
+    other = read_time_series(kind, us=us, dates=dates, source_dir=source_dir, rows=rows)
+    if rows is not None and not matched(cases, other, ts_keys(us)).all():
+        other = read_time_series(kind, us=us, dates=dates, source_dir=source_dir)
+    return other
+
+
+def transform(us, dates, ids, source_dir=SOURCE_DIR, rows=None):
+    cases = read_cases(us=us, dates=dates, source_dir=source_dir, rows=rows)
+    if rows is not None:
+        ids = ids.loc[cases.index]
+    deaths = read_matching('deaths', cases, us=us, dates=dates, source_dir=source_dir, rows=rows)
+    recovered = None if us else read_matching('recovered', cases, us=us, dates=dates, source_dir=source_dir, rows=rows)
+    return long_form_cases(cases, ids, deaths, recovered, dates, us=us)
+
+
+def stage(cur, long_form):
+    buffer = io.StringIO()
+    long_form.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d')
+    buffer.seek(0)
+    cur.copy_expert(COPY_CASES_STAGING, buffer)
+    return len(long_form)
+
+
+def stage_chunk(dsn, source_dir, us, dates, ids, rows=None):
+    # a pool task: parse and transform some of a source's days, or some of its rows, and COPY them into cases_staging
+    # over its own connection. ids come from the parent, which is the only one writing dimension rows
+    long_form = transform(us, dates, ids, source_dir=source_dir, rows=rows)
+    conn = psycopg2.connect(dsn)
+    try:
+        rows = stage(conn.cursor(), long_form)
         conn.commit()
-        cur.execute(INSERT_SUBDIVISION, [subdivision, country_id])
-        cur.execute(GET_SUBDIVISION, [subdivision])
-        subdivision_id, _, _ = cur.fetchone()
-        if us and not isinstance(county, float):
-            cur.execute(INSERT_COUNTY, [county, subdivision_id])
-            conn.commit()
-            cur.execute(GET_COUNTY, [county, subdivision_id])
-            county_id, _, _ = cur.fetchone()
-            deaths_df = deaths_df.loc[deaths_df[county_col_head] == county]
-        else:
-            county_id = 0
+    finally:
+        conn.close()
+    return us, rows
 
-    else:
-        deaths_df = deaths.loc[(deaths[province_state].isnull()) & (deaths[country_region] == country)]
-        if isinstance(recovered, DataFrame):
-            recovered_df = recovered.loc[(recovered[province_state].isnull()) & (recovered[country_region] == country)]
-        cur.execute(INSERT_COUNTRY, (country,))
+
+def matched(rows, other, keys):
+    # which of rows have a key in other
+    found = rows[keys].merge(other[keys].drop_duplicates(), on=keys, how='left', indicator=True)['_merge'] == 'both'
+    return found.values
+
+
+def stream_source(cur, resolver, us, dates, chunksize=STREAM_CHUNK_ROWS, source_dir=SOURCE_DIR):
+    # reads the confirmed, deaths and recovered files side by side a chunk at a time, and stages each chunk before
+    # reading the next, so memory follows the chunk size rather than the length of the files. the files list regions
+    # in (nearly) the same order; a cases row waits until its deaths and recovered rows have been read, or until
+    # those files run out, and rows that are matched are dropped from the others
+    keys = ts_keys(us)
+    def read_chunks(kind):
+        return read_time_series_chunks(kind, us=us, dates=dates, chunksize=chunksize, source_dir=source_dir)
+
+    readers = {'deaths': read_chunks('deaths')}
+    if not us:
+        readers['recovered'] = read_chunks('recovered')
+    # each starts from its first chunk: concatenating onto an empty frame would make the Int32 counts objects
+    others = {kind: None for kind in readers}
+    waiting = None
+    rows = 0
+    for cases in read_chunks('confirmed'):
+        cases = without_us(cases, us)
+        waiting = cases if waiting is None else pd.concat([waiting, cases])
+        for kind in list(readers):
+            chunk = next(readers[kind], None)
+            if chunk is None:
+                del readers[kind]
+                if others[kind] is None:
+                    others[kind] = DataFrame(columns=keys + list(dates))
+            else:
+                others[kind] = chunk if others[kind] is None else pd.concat([others[kind], chunk])
+        ready = np.ones(len(waiting), dtype=bool)
+        for kind in readers:
+            ready &= matched(waiting, others[kind], keys)
+        rows += stage_stream_chunk(cur, resolver, waiting.loc[ready], others, dates, us)
+        for kind in others:
+            others[kind] = others[kind].loc[~matched(others[kind], waiting.loc[ready], keys)]
+        waiting = waiting.loc[~ready]
+    if waiting is not None and len(waiting):
+        rows += stage_stream_chunk(cur, resolver, waiting, others, dates, us)
+    return rows
+
+
+def stage_stream_chunk(cur, resolver, cases, others, dates, us):
+    if not len(cases):
+        return 0
+    ids = resolver.resolve(cases, us=us)
+    return stage(cur, long_form_cases(cases, ids, others['deaths'], others.get('recovered'), dates, us=us))
+
+
+def peak_rss():
+    # in MB. ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    )
+
+
+def date_chunks(dates, chunks):
+    return [list(chunk) for chunk in np.array_split(dates, min(chunks, len(dates)))]
+
+
+def row_chunks(count, chunks):
+    # [start, stop) ranges of a file's rows
+    return [(int(chunk[0]), int(chunk[-1]) + 1) for chunk in np.array_split(np.arange(count), min(chunks, count))]
+
+
+def chunk_tasks(dsn, source_dir, us, dates, ids, workers):
+    # the US file has a row per county, and splitting it by rows means each worker only parses its own share of it;
+    # the global file is split by days, since its recovered file doesn't list the same rows
+    if us and workers > 1 and len(ids) > 1:
+        return [
+            (dsn, source_dir, us, dates, ids.loc[start:stop - 1], (start, stop))
+            for start, stop in row_chunks(len(ids), workers)
+        ]
+    return [(dsn, source_dir, us, chunk, ids, None) for chunk in date_chunks(dates, workers)]
+
+
+def refresh_aggregates(conn, full=False):
+    # aggregates are complete up to the day both sources have reached; recompute everything after that
+    cur = conn.cursor()
+    started = time.perf_counter()
+    cur.execute(GET_WATERMARK, ['aggregates'])
+    row = cur.fetchone()
+    refreshed = row[0] if row else None
+    cur.execute(GET_COMPLETE_DAY)
+    complete = cur.fetchone()[0]
+    if not full and refreshed is not None and refreshed == complete:
+        print('aggregates: up to date')
+        return
+
+    since = '-infinity' if full or refreshed is None else refreshed + datetime.timedelta(days=1)
+    cur.execute(PRUNE_ROLLUP)
+    cur.execute(BUMP_DATA_VERSION)
+    version = cur.fetchone()[0]
+    cur.execute(REFRESH_ROLLUP, {
+        'since': since, 'complete': 'infinity' if complete is None else complete, 'version': version,
+    })
+    if complete is not None:
+        cur.execute(ADVANCE_WATERMARK, ['aggregates', complete])
+    conn.commit()
+
+    conn.autocommit = True
+    cur.execute(VACUUM_CHART_TABLES)
+    conn.autocommit = False
+    print('aggregates: refreshed from {} in {:.2f}s, data version {}'.format(
+        since, time.perf_counter() - started, version
+    ))
+
+
+class Pipeline:
+    # the ETL as a run of stages. what a stage works out for the ones after it goes in self.state, which is saved with
+    # the name of the stage in etl_checkpoint once the stage has committed; a run that fails is picked up after the
+    # last stage it finished by the next one
+    def __init__(
+        self, dsn=DSN, source_dir=SOURCE_DIR, full=False, workers=1, row_by_row=False, stream=False,
+        chunksize=STREAM_CHUNK_ROWS, snapshot_dir=None, metrics_file=None, warm_up=False, warm_up_top=None,
+        warm_up_concurrency=4
+    ):
+        self.dsn = dsn
+        self.source_dir = source_dir
+        self.full = full
+        self.workers = 1 if row_by_row or stream else max(workers, 1)
+        self.row_by_row = row_by_row
+        self.stream = stream
+        self.chunksize = chunksize
+        self.snapshot_dir = snapshot_dir
+        self.metrics_file = metrics_file
+        self.warm_up = warm_up
+        self.warm_up_top = warm_up_top
+        self.warm_up_concurrency = warm_up_concurrency
+        self.state = {}
+        self.ids = {}
+        self.resumed = False
+
+    def stages(self):
+        return [
+            ('extract', self.extract),
+            ('transform', self.transform),
+            ('load', self.load),
+            ('post-process', self.post_process),
+            ('aggregates', self.refresh_aggregates),
+            ('snapshot', self.write_snapshot),
+            ('warm-up', self.warm_up_cache),
+            ('publish', self.publish),
+        ]
+
+    def sources(self):
+        return [(us, dates) for us, dates in self.state['sources']]
+
+    def extract(self, conn):
+        # finds the days each source has that the database doesn't, and adds any new regions
+        cur = conn.cursor()
+        resolver = DimensionResolver(cur)
+        self.state['sources'] = []
+        for us in (False, True):
+            dates = get_new_dates(cur, us=us, full=self.state['full'], source_dir=self.source_dir)
+            if not dates:
+                print('{}: up to date'.format(source_name(us)))
+                continue
+            self.state['sources'].append((us, dates))
+            if not self.stream:  # streamed files resolve their ids a chunk at a time
+                self.ids[us] = resolver.resolve(read_cases(us=us, source_dir=self.source_dir), us=us)
+
+    def resolve_ids(self, cur, us):
+        # a resumed run lost the ids with the process, but the regions are in the database now
+        if us not in self.ids:
+            self.ids[us] = DimensionResolver(cur).resolve(read_cases(us=us, source_dir=self.source_dir), us=us)
+        return self.ids[us]
+
+    def transform(self, conn):
+        # parses the new days and COPYs them into cases_staging, or inserts them one by one with row_by_row
+        cur = conn.cursor()
+        sources = self.sources()
+        rows = {us: 0 for us, _ in sources}
+        cur.execute(TRUNCATE_CASES_STAGING)
         conn.commit()
-        cur.execute(GET_COUNTRY, [country])
-        country_id, _ = cur.fetchone()
-
-        subdivision_id = 0  # dummy subdivision for unique constraint
-        county_id = 0
-
-    for date in dates:
-        exclude_recoveries = False
-        cur.execute('SELECT EXISTS (SELECT 1 FROM tracked_dates WHERE day=%s)', [date])
-        is_date_tracked = cur.fetchone()[0]
-        if is_date_tracked:
-            continue
-        cases_date = row[date]
-        deaths_date = deaths_df.iloc[0][date]
-        if isinstance(recovered, DataFrame):
-            try:
-                # some countries don't have subdivision recoveries data -- we ignore these countries for now
-                recovered_date = recovered_df.iloc[0][date]
-            except:            
-                exclude_recoveries = True
+        started = time.perf_counter()
+        if self.row_by_row:
+            for us, dates in sources:
+                rows[us] = insert_cases(conn, transform(us, dates, self.resolve_ids(cur, us), self.source_dir))
+        elif self.stream:
+            resolver = DimensionResolver(cur)
+            for us, dates in sources:
+                rows[us] = stream_source(
+                    cur, resolver, us, dates, chunksize=self.chunksize, source_dir=self.source_dir
+                )
         else:
-            exclude_recoveries = True
-        if cases_date is np.nan:
-            continue  # no data for this day (yet?) -- allowing other numbers to be nan, but not this one
-        cur.execute(
-            INSERT_CASES, (
-                date, 
-                country_id, 
-                subdivision_id,
-                county_id,
-                nan_to_int(cases_date), 
-                nan_to_int(deaths_date), 
-                nan_to_int(recovered_date) if not exclude_recoveries else 0
-            )
-        )
+            # each source is split into a chunk per worker, and the chunks of both sources share the pool
+            tasks = [
+                task for us, dates in sources
+                for task in chunk_tasks(self.dsn, self.source_dir, us, dates, self.resolve_ids(cur, us), self.workers)
+            ]
+            conn.commit()
+            if self.workers > 1 and tasks:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    staged = list(executor.map(stage_chunk, *zip(*tasks)))
+            else:
+                staged = [stage_chunk(*task) for task in tasks]
+            for us, chunk_rows in staged:
+                rows[us] += chunk_rows
+        elapsed = time.perf_counter() - started
+        for us, dates in sources:
+            print('{}: {} rows for {} days'.format(source_name(us), rows[us], len(dates)))
+        print('{}: {} rows in {:.2f}s with {} worker{} ({:.0f} rows/sec)'.format(
+            'insert' if self.row_by_row else 'stream, transform and stage' if self.stream else
+            'parse, transform and stage', sum(rows.values()), elapsed, self.workers, '' if self.workers == 1 else 's',
+            sum(rows.values()) / elapsed if elapsed else 0
+        ))
+        self.state['rows'] = {source_name(us): source_rows for us, source_rows in rows.items()}
+
+    def load(self, conn):
+        # moves the staged rows into cases and advances the watermarks, in the transaction that saves the checkpoint
+        cur = conn.cursor()
+        if not self.row_by_row:
+            if self.resumed:
+                # cases_staging is unlogged, so a database crash since the transform empties it
+                cur.execute(COUNT_CASES_STAGING)
+                if cur.fetchone()[0] != sum(self.state['rows'].values()):
+                    print('load: cases_staging lost its rows, transforming again')
+                    self.transform(conn)
+            cur.execute(INSERT_CASES_FROM_STAGING)
+            cur.execute(TRUNCATE_CASES_STAGING)
+        for us, dates in self.sources():
+            cur.execute(ADVANCE_WATERMARK, [source_name(us), max(parse_date(date) for date in dates)])
+
+    def post_process(self, conn):
+        cur = conn.cursor()
+        cur.execute(DELETE_NEW_YORK_BORO_DATA)
+        cur.execute(DELETE_BOROS)
+
+    def refresh_aggregates(self, conn):
+        refresh_aggregates(conn, full=self.state['full'])
+
+    def write_snapshot(self, conn):
+        if not self.snapshot_dir:
+            return
+        cur = conn.cursor()
+        cur.execute(GET_DATA_VERSION)
+        path = snapshot.write_snapshot(cur, self.snapshot_dir, cur.fetchone()[0])
+        print('snapshot: written to {}'.format(path))
+
+    def warm_up_cache(self, conn):
+        # in a process of its own, since it runs the app's code with the app's settings (COVID_CACHE_URL and so on)
+        if not self.warm_up:
+            return
+        cur = conn.cursor()
+        cur.execute(GET_DATA_VERSION)
+        command = [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warmup.py'),
+            '--version', str(cur.fetchone()[0]), '--concurrency', str(self.warm_up_concurrency), '--no-publish',
+        ]
+        if self.warm_up_top:
+            command.extend(['--top', str(self.warm_up_top)])
         conn.commit()
+        sys.stdout.flush()
+        subprocess.run(command, env=dict(os.environ, COVID_DSN=self.dsn), check=True)
+
+    def publish(self, conn):
+        # one UPDATE, so every app worker goes from the old version to the new one at its next version check. warmup
+        # (and the app's db module with it) is only imported here, so importing etl leaves db unloaded
+        import warmup
 
+        cur = conn.cursor()
+        cur.execute(GET_DATA_VERSION)
+        version = cur.fetchone()[0]
+        cur.execute(warmup.PUBLISH_DATA_VERSION, [version])
+        live = cur.fetchone()[0]
+        if self.snapshot_dir:
+            # the snapshot follows the database, so a run that fails in between points CURRENT at it when resumed
+            conn.commit()
+            snapshot.make_current(self.snapshot_dir, version)
+        print('publish: version {} is live'.format(live))
 
-for _, row in cases.iterrows():
-    insert_ts_row(row)
+    def run(self, restart=False):
+        # returns how long each stage took, in seconds
+        conn = psycopg2.connect(self.dsn)
+        timings = []
+        try:
+            cur = conn.cursor()
+            create_schema(cur)
+            if restart:
+                cur.execute(CLEAR_CHECKPOINT)
+            cur.execute(GET_CHECKPOINT)
+            checkpoint = cur.fetchone()
+            conn.commit()
 
-cases = pd.read_csv('../COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv')
-deaths = pd.read_csv('../COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv')
-for _, row in cases.iterrows():
-    dates = cases.columns[11:]
-    insert_ts_row(row, us=True, deaths=deaths, recovered=None)
+            names = [name for name, _ in self.stages()]
+            done = -1
+            self.state = {'full': self.full}
+            if checkpoint:
+                finished, self.state, started_at = checkpoint
+                done = names.index(finished)
+                self.resumed = True
+                print('resuming the run started {:%Y-%m-%d %H:%M:%S} after its {} stage'.format(started_at, finished))
 
+            for name, stage in self.stages()[done + 1:]:
+                started = time.perf_counter()
+                try:
+                    stage(conn)
+                    cur.execute(SAVE_CHECKPOINT, [name, json.dumps(self.state)])
+                    conn.commit()
+                except BaseException:
+                    print('{}: failed; run the ETL again to resume from here'.format(name))
+                    raise
+                timings.append((name, time.perf_counter() - started))
+
+            cur.execute(CLEAR_CHECKPOINT)
+            conn.commit()
+        finally:
+            conn.close()
+
+        if self.metrics_file:
+            for name, elapsed in timings:
+                STAGE_SECONDS.set(elapsed, name)
+            for source, source_rows in self.state.get('rows', {}).items():
+                ROWS.set(source_rows, source)
+            LAST_SUCCESS.set(time.time())
+            ETL_METRICS.write(self.metrics_file)
+        return timings
+
+
+parser = argparse.ArgumentParser(description='Load the Johns Hopkins time series into the covid database.')
+parser.add_argument(
+    '--dsn', default=DSN,
+    help='the database to load, as a libpq connection string (default: $COVID_DSN or "dbname=covid")'
+)
+parser.add_argument(
+    '--source-dir', default=SOURCE_DIR, metavar='DIR',
+    help="the Johns Hopkins repository's csse_covid_19_time_series directory (default: $COVID_SOURCE_DIR or {})".format(
+        '../COVID-19/csse_covid_19_data/csse_covid_19_time_series'
+    )
+)
+parser.add_argument(
+    '--metrics-file', metavar='PATH',
+    help="write the run's stage timings and rows here in the Prometheus text format, for node_exporter's textfile "
+         'collector'
+)
+parser.add_argument(
+    '--warm-up', action='store_true',
+    help="fill the app's (shared) cache for the new data before publishing it; see warmup.py"
+)
+parser.add_argument(
+    '--warm-up-top', type=int, metavar='N',
+    help='warm only the N most requested regions (by $COVID_REQUEST_LOG, else the largest) rather than all of them'
+)
+parser.add_argument(
+    '--warm-up-concurrency', type=int, default=4, metavar='N', help='queries the warm-up has in flight at once'
+)
+parser.add_argument(
+    '--restart', action='store_true',
+    help='start over instead of resuming a run that failed'
+)
+parser.add_argument(
+    '--row-by-row', action='store_true',
+    help='insert and commit one cell at a time (the old loader, kept for comparison)'
+)
+parser.add_argument(
+    '--full', action='store_true',
+    help='load every date in the files instead of only those after the watermark; existing rows are left alone'
+)
+parser.add_argument(
+    '--snapshot-dir', metavar='DIR',
+    help='also write a columnar snapshot of the current data version here, for the app to serve without the database'
+)
+parser.add_argument(
+    '--stream', action='store_true',
+    help='read the files a chunk of rows at a time, so memory stays flat as they get wider (one process)'
+)
+parser.add_argument(
+    '--chunksize', type=int, default=STREAM_CHUNK_ROWS, metavar='ROWS',
+    help='rows per chunk with --stream (default {})'.format(STREAM_CHUNK_ROWS)
+)
+parser.add_argument(
+    '--workers', type=int, default=os.cpu_count() or 1,
+    help='processes parsing, transforming and staging the files in parallel (default: one per CPU)'
+)
+
+
+def main():
+    args = parser.parse_args()
+    pipeline = Pipeline(
+        dsn=args.dsn, source_dir=args.source_dir, full=args.full, workers=args.workers, row_by_row=args.row_by_row,
+        stream=args.stream, chunksize=args.chunksize, snapshot_dir=args.snapshot_dir, metrics_file=args.metrics_file,
+        warm_up=args.warm_up, warm_up_top=args.warm_up_top, warm_up_concurrency=args.warm_up_concurrency
+    )
+    timings = pipeline.run(restart=args.restart)
+    for name, elapsed in timings:
+        print('{:>14}: {:.2f}s'.format(name, elapsed))
+    print('{:>14}: {:.2f}s'.format('total', sum(elapsed for _, elapsed in timings)))
+    rss = peak_rss()
+    if rss:
+        print('peak RSS: {:.0f} MB{}'.format(rss[0], ', largest worker {:.0f} MB'.format(rss[1]) if rss[1] else ''))
 
-for date in dates:
-    cur.execute(INSERT_TRACKED_DATE, [date])
-    conn.commit()
 
-cur.execute(DELETE_NEW_YORK_BORO_DATA)
-cur.execute(DELETE_BOROS)
-conn.commit()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
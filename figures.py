@@ -0,0 +1,50 @@
+import numpy as np
+
+
+# plotly figures built straight from column arrays: a list per trace, dates already ISO strings, and nothing per day
+
+METRICS = ['cases', 'deaths', 'recovered']
+TRACE_NAMES = {'cases': 'Cases', 'deaths': 'Deaths', 'recovered': 'Recovered'}
+DECIMALS = 4
+# plotly steps date axes in milliseconds
+DAY = 24 * 60 * 60 * 1000
+
+
+def compact(values):
+    # the shortest JSON for a column: whole numbers as ints, everything else rounded, NaN as null
+    values = np.round(values, DECIMALS)
+    missing = np.isnan(values)
+    present = values[~missing]
+    if np.array_equal(present, np.trunc(present)):
+        values = np.where(missing, 0, values).astype(np.int64)
+    if not missing.any():
+        return values.tolist()
+    column = values.astype(object)
+    column[missing] = None
+    return column.tolist()
+
+
+def x_values(days):
+    # a run of consecutive days goes out as its first day and a step, instead of a date per point in every trace
+    if days and (np.datetime64(days[-1]) - np.datetime64(days[0])).astype(int) == len(days) - 1:
+        return {'x0': days[0], 'dx': DAY}
+    return {'x': days}
+
+
+def trace(days, values, name):
+    return dict(x_values(days), y=compact(values), type='line', name=name)
+
+
+def series_traces(columns):
+    return [(TRACE_NAMES[metric], columns[metric]) for metric in METRICS]
+
+
+def figure(days, traces, axis_type):
+    # traces are (name, values) pairs, the values aligned on days
+    return {
+        'data': [trace(days, values, name) for name, values in traces],
+        'layout': {
+            'xaxis': {'type': 'date'},
+            'yaxis': {'type': axis_type}
+        }
+    }
@@ -0,0 +1,79 @@
+import hashlib
+import json
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# cache headers for callback responses. a deterministic callback's response depends only on its inputs, the data
+# version and the code and settings that build it, so the ETag is made from those before the callback runs, and a
+# request that already has the response is answered with a 304 without running it. the ETag is weak because the same
+# response goes out gzipped, brotli'd or not at all.
+# callbacks are POSTs, which browsers and CDNs don't cache by default: the headers only do anything behind a proxy set
+# up to cache POST requests keyed on their body
+
+BROTLI_QUALITY = 5
+
+
+def fingerprint(paths, **settings):
+    # the code and settings a deploy serves responses with, so that changing either lets go of responses kept under
+    # the old ones
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode())
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def install(app, version, outputs, max_age, build=''):
+    # version returns the current data version; outputs are the 'id.property' callback outputs that are deterministic;
+    # build is a fingerprint of the code and settings behind them
+    server = app.server
+    path = app.config.routes_pathname_prefix + '_dash-update-component'
+
+    def callback_etag():
+        if flask.request.path != path or flask.request.method != 'POST':
+            return None
+        body = flask.request.get_json(silent=True) or {}
+        if body.get('output') not in outputs:
+            return None
+        key = json.dumps(
+            [build, version(), body.get('output'), body.get('inputs'), body.get('state')], sort_keys=True
+        )
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @server.before_request
+    def answer_conditional_request():
+        flask.g.callback_etag = callback_etag()
+        if flask.g.callback_etag and flask.request.if_none_match.contains_weak(flask.g.callback_etag):
+            return flask.Response(status=304)
+
+    @server.after_request
+    def add_cache_headers(response):
+        etag = flask.g.get('callback_etag')
+        if etag and response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'public, max-age={}'.format(max_age)
+            response.vary.add('Accept-Encoding')
+        if brotli is not None and response.status_code == 200:
+            compress(server, response)
+        return response
+
+
+def compress(server, response):
+    # flask-compress only does gzip, and leaves alone anything that's already encoded
+    if (
+        'br' not in flask.request.accept_encodings or
+        'Content-Encoding' in response.headers or
+        response.direct_passthrough or
+        response.mimetype not in server.config.get('COMPRESS_MIMETYPES', ['application/json']) or
+        (response.content_length or 0) < server.config.get('COMPRESS_MIN_SIZE', 500)
+    ):
+        return
+    response.set_data(brotli.compress(response.get_data(), quality=BROTLI_QUALITY))
+    response.headers['Content-Encoding'] = 'br'
+    response.vary.add('Accept-Encoding')
@@ -0,0 +1,294 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# counters, gauges and histograms in the Prometheus text format, without the client library. they're kept per
+# process; a registry given a directory (COVID_METRICS_DIR for the app's) also writes its process's values to
+# <directory>/<pid>-<started>.json a second or so after they change, and renders the sum of every process's, so that
+# whichever gunicorn worker answers a scrape reports them all. counters and histograms are summed, including those of
+# workers that have exited, so they never go down: a file is named for when its process started as well as its pid,
+# so a new worker given an old one's pid doesn't overwrite it. the app has no gauges; the ETL's registry, which has,
+# writes no files. nothing removes the files, and a scrape reads every one, so the directory has to be emptied
+# whenever the server starts (as prometheus_client's multiprocess mode asks)
+
+# seconds
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+# bytes, 1 KB to 16 MB
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(8))
+# seconds
+FLUSH_INTERVAL = 1
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in labels) + '}'
+
+
+def replace(path, text):
+    # readers (node_exporter's textfile collector, other workers) mustn't see a half-written file
+    temporary = os.path.join(os.path.dirname(path) or '.', '.{}.tmp'.format(os.path.basename(path)))
+    with open(temporary, 'w') as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+
+class Registry:
+    def __init__(self, directory=None):
+        self.metrics = []
+        self.directory = directory
+        self._dirty = threading.Event()
+        self._lock = threading.Lock()
+        # the process whose values the flushing thread writes out, and when it started; a forked worker starts its own
+        self._flusher = None
+        self._started = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def values(self):
+        return {metric.name: metric.export() for metric in self.metrics}
+
+    def processes(self):
+        # every process's values by (pid, started), this one's as they are now rather than as last written
+        this = (os.getpid(), self._started)
+        processes = {}
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                parts = name[:-5].split('-')
+                if not name.endswith('.json') or len(parts) != 2 or not all(part.isdigit() for part in parts):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        processes[(int(parts[0]), int(parts[1]))] = json.load(f)
+                except (OSError, ValueError):
+                    continue  # gone since it was listed
+        processes[this] = self.values()
+        return processes
+
+    def render(self):
+        processes = self.processes()
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for suffix, labels, value in metric.samples(metric.merge(processes)):
+                lines.append('{}{}{} {}'.format(metric.name, suffix, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        replace(path, self.render())
+
+    def prepare_change(self):
+        # before a metric changes. the first change in a process starts the thread that writes its values out; a
+        # worker forked from a process that had values starts from none, since those are the parent's to write
+        if self.directory is None or self._flusher == os.getpid():
+            return
+        with self._lock:
+            if self._flusher == os.getpid():
+                return
+            if self._flusher is not None:
+                for metric in self.metrics:
+                    metric.reset()
+            self._flusher = os.getpid()
+            self._started = int(time.time() * 1000000)
+            self._dirty = threading.Event()
+            threading.Thread(target=self._flush_changes, args=(self._dirty,), daemon=True).start()
+            atexit.register(self.flush)
+
+    def changed(self):
+        if self.directory is not None:
+            self._dirty.set()
+
+    def _flush_changes(self, dirty):
+        while True:
+            dirty.wait()
+            dirty.clear()
+            self.flush()
+            time.sleep(FLUSH_INTERVAL)
+
+    def path(self):
+        # where this process's values are written
+        return os.path.join(self.directory, '{}-{}.json'.format(os.getpid(), self._started))
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        replace(self.path(), json.dumps(self.values()))
+
+
+REGISTRY = Registry(os.environ.get('COVID_METRICS_DIR'))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError('{} takes labels {}'.format(self.name, self.labels))
+        return tuple(str(value) for value in label_values)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def export(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def combine(self, value, other):
+        return value + other
+
+    def merge(self, processes):
+        # processes are {(pid, started): {metric name: exported values}}
+        values = {}
+        for exported in processes.values():
+            for key, value in exported.get(self.name, ()):
+                key = tuple(key)
+                values[key] = self.combine(values[key], value) if key in values else value
+        return values
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield '', list(zip(self.labels, key)), value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        self.registry.prepare_change()
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.changed()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        key = self._key(label_values)
+        self.registry.prepare_change()
+        with self._lock:
+            self._values[key] = value
+        self.registry.changed()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labels=labels, registry=registry)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        self.registry.prepare_change()
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            self._values[key] = (counts, total + value)
+        self.registry.changed()
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def export(self):
+        with self._lock:
+            return [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+    def combine(self, value, other):
+        return [[count + more for count, more in zip(value[0], other[0])], value[1] + other[1]]
+
+    def samples(self, values):
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                yield '_bucket', labels + [('le', format_value(bound))], count
+            yield '_sum', labels, total
+            yield '_count', labels, counts[-1]
+
+
+# the app's. queries are named after the constant holding their SQL (see db.name_queries)
+CALLBACK_SECONDS = Histogram('covid_callback_seconds', 'Dash callback latency.', ['output'])
+CALLBACK_RESPONSE_BYTES = Histogram(
+    'covid_callback_response_bytes', 'Size of the JSON a Dash callback responds with, before compression.',
+    ['output'], buckets=SIZE_BUCKETS
+)
+CALLBACK_ERRORS = Counter('covid_callback_errors_total', 'Dash callbacks that raised.', ['output'])
+QUERY_SECONDS = Histogram('covid_query_seconds', 'Database query latency, fetch included.', ['query'])
+QUERY_ROWS = Counter('covid_query_rows_total', 'Rows fetched from the database.', ['query'])
+QUERY_ERRORS = Counter('covid_query_errors_total', 'Database queries that failed, retries included.', ['query'])
+CACHE_REQUESTS = Counter(
+    'covid_cache_requests_total', 'Lookups of chart series and dropdown options in the data cache.', ['name', 'result']
+)
+COALESCED_FETCHES = Counter(
+    'covid_coalesced_fetches_total', 'Cache misses that waited on the same fetch in flight instead of making their own.',
+    ['name']
+)
+
+
+def instrument_callbacks(app):
+    # wraps every server-side callback registered so far. dash's wrappers return the response JSON, so its length is
+    # the payload size
+    from dash.exceptions import PreventUpdate
+
+    for output, callback in app.callback_map.items():
+        if 'callback' in callback:
+            callback['callback'] = instrument_callback(output, callback['callback'], PreventUpdate)
+
+
+def instrument_callback(output, func, prevent_update):
+    def instrumented(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+        except prevent_update:
+            raise
+        except Exception:
+            CALLBACK_ERRORS.inc(output)
+            raise
+        finally:
+            CALLBACK_SECONDS.observe(time.perf_counter() - started, output)
+        CALLBACK_RESPONSE_BYTES.observe(len(response), output)
+        return response
+    return instrumented
+
+
+def install(server, path='/metrics', registry=REGISTRY):
+    import flask
+
+    @server.route(path)
+    def metrics():
+        return flask.Response(registry.render(), mimetype='text/plain; version=0.0.4')
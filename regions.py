@@ -0,0 +1,95 @@
+import bisect
+
+
+# the country > subdivision > county hierarchy, a few thousand names that only change with a load. the app builds one
+# per data version and serves every dropdown from it, and searches it as the user types. regions are (level, id)
+# like the rollup's, and labelled with their parents: "county, subdivision, country"
+
+SEARCH_LIMIT = 20
+
+
+class RegionIndex:
+    def __init__(self, countries, subdivisions, counties):
+        # (id, name), (id, name, country) and (id, name, subdivision) rows
+        self._countries = sorted(((country_id, name) for country_id, name in countries), key=by_name)
+        self._children = {}
+        for level, rows in (('country', subdivisions), ('subdivision', counties)):
+            for region_id, name, parent in rows:
+                self._children.setdefault((level, parent), []).append((region_id, name))
+        for children in self._children.values():
+            children.sort(key=by_name)
+
+        country_names = dict(self._countries)
+        subdivision_labels = {
+            subdivision_id: labelled(name, country_names.get(country))
+            for subdivision_id, name, country in subdivisions
+        }
+        self._regions = [('country', country_id, name) for country_id, name in self._countries]
+        self._regions.extend(
+            ('subdivision', subdivision_id, label) for subdivision_id, label in subdivision_labels.items()
+        )
+        self._regions.extend(
+            ('county', county_id, labelled(name, subdivision_labels.get(subdivision)))
+            for county_id, name, subdivision in counties
+        )
+        self._regions.sort(key=lambda region: region[2])
+        self._labels = {(level, region_id): label for level, region_id, label in self._regions}
+        # a label starts with the region's own name, so a prefix search is a bisect into them sorted
+        self._names = sorted((label.lower(), position) for position, (_, _, label) in enumerate(self._regions))
+
+    @classmethod
+    def from_rows(cls, rows):
+        # (level, id, name, parent id) rows, as REGION_HIERARCHY returns them
+        levels = {'country': [], 'subdivision': [], 'county': []}
+        for level, region_id, name, parent in rows:
+            levels[level].append((region_id, name) if level == 'country' else (region_id, name, parent))
+        return cls(levels['country'], levels['subdivision'], levels['county'])
+
+    def countries(self):
+        return list(self._countries)
+
+    def subdivisions(self, country):
+        return list(self._children.get(('country', country), []))
+
+    def counties(self, subdivision):
+        return list(self._children.get(('subdivision', subdivision), []))
+
+    def regions(self):
+        # (level, id, label) for every region, by label
+        return list(self._regions)
+
+    def label(self, level, region_id):
+        return self._labels.get((level, region_id))
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        # regions whose label starts with text, then those with a word in the label that does, then any containing
+        # it; case-insensitive, at most limit of them
+        text = (text or '').strip().lower()
+        found = []
+        start = bisect.bisect_left(self._names, (text,))
+        for label, position in self._names[start:]:
+            if not label.startswith(text) or len(found) == limit:
+                break
+            found.append(position)
+        if len(found) < limit:
+            chosen = set(found)
+            words = []
+            anywhere = []
+            for label, position in self._names:
+                if position in chosen or text not in label:
+                    continue
+                if any(word.startswith(text) for word in label.replace(',', ' ').split()):
+                    words.append(position)
+                else:
+                    anywhere.append(position)
+            found.extend((words + anywhere)[:limit - len(found)])
+        return [self._regions[position] for position in found]
+
+
+def by_name(row):
+    return (row[1] or '', row[0])
+
+
+def labelled(name, parent_label):
+    # a region whose parent isn't known goes by its own name
+    return '{}, {}'.format(name, parent_label) if parent_label else name
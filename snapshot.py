@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+
+# an immutable, versioned copy of everything the app serves. each (level, metric) is one int32 .npy
+# matrix with a row per region and a column per day of the shared date axis, so every series is one contiguous
+# array. the app memory-maps them: no database connections, and workers share the pages through the OS cache.
+#
+#   <directory>/CURRENT                           the live version, swapped atomically when one is published
+#   <directory>/<version>/days.npy                the shared date axis (datetime64[D])
+#   <directory>/<version>/regions.json            dropdown contents and the region id of each matrix row
+#   <directory>/<version>/<level>.<metric>.npy
+
+LEVELS = ['world', 'country', 'subdivision', 'county']
+METRICS = ['cases', 'deaths', 'recovered']
+# marks a day with no data
+MISSING = np.iinfo(np.int32).min
+KEEP_VERSIONS = 2
+
+# the rollup as of the version being written (see etl.CREATE_ROLLUP_TABLE)
+COPY_SERIES = '''
+COPY (
+    SELECT ref_id, day, positive_cases, deaths, recovered FROM cases_rollup
+    WHERE level = %(level)s AND version <= %(version)s AND (retired IS NULL OR retired > %(version)s)
+) TO STDOUT WITH CSV;
+'''
+
+SNAPSHOT_COUNTRIES = '''
+SELECT id, name FROM country WHERE id > 0 ORDER BY name;
+'''
+SNAPSHOT_SUBDIVISIONS = '''
+SELECT id, name, country FROM subdivision WHERE id > 0 ORDER BY name;
+'''
+SNAPSHOT_COUNTIES = '''
+SELECT id, name, subdivision FROM county WHERE id > 0 ORDER BY name;
+'''
+SNAPSHOT_DEFAULT_COUNTRY = '''SELECT id FROM country WHERE name='US';'''
+
+
+def _read_series(cur, level, version):
+    # pandas is only needed to write snapshots, and the app (which only reads them) starts quicker without it
+    import pandas as pd
+
+    buffer = io.StringIO()
+    cur.copy_expert(cur.mogrify(COPY_SERIES, {'level': level, 'version': version}).decode(), buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer, names=['ref_id', 'day'] + METRICS, parse_dates=['day'])
+
+
+def write_snapshot(cur, directory, version):
+    # builds <directory>/<version>; CURRENT is left alone until the version is published (make_current)
+    path = os.path.join(directory, str(version))
+    if os.path.exists(path):
+        # built by a run that died before publishing it
+        return path
+    os.makedirs(directory, exist_ok=True)
+    building = os.path.join(directory, '.building-{}'.format(version))
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    series = {level: _read_series(cur, level, version) for level in LEVELS}
+    # every region's days fall inside the world's
+    days = np.arange(
+        series['world']['day'].min(), series['world']['day'].max() + np.timedelta64(1, 'D'), dtype='datetime64[D]'
+    ) if len(series['world']) else np.array([], dtype='datetime64[D]')
+    np.save(os.path.join(building, 'days.npy'), days)
+
+    refs = {}
+    for level in LEVELS:
+        refs[level] = np.unique(series[level]['ref_id'].values)
+        rows = np.searchsorted(refs[level], series[level]['ref_id'].values)
+        columns = (series[level]['day'].values.astype('datetime64[D]') - days[:1]).astype(int)
+        for metric in METRICS:
+            matrix = np.full((len(refs[level]), len(days)), MISSING, dtype=np.int32)
+            matrix[rows, columns] = series[level][metric].fillna(MISSING).values.astype(np.int32)
+            np.save(os.path.join(building, '{}.{}.npy'.format(level, metric)), matrix)
+
+    cur.execute(SNAPSHOT_COUNTRIES)
+    countries = cur.fetchall()
+    cur.execute(SNAPSHOT_SUBDIVISIONS)
+    subdivisions = cur.fetchall()
+    cur.execute(SNAPSHOT_COUNTIES)
+    counties = cur.fetchall()
+    cur.execute(SNAPSHOT_DEFAULT_COUNTRY)
+    default_country = cur.fetchone()
+    with open(os.path.join(building, 'regions.json'), 'w') as f:
+        json.dump({
+            'countries': countries,
+            'subdivisions': subdivisions,
+            'counties': counties,
+            'default_country': default_country[0] if default_country else 0,
+            'refs': {level: refs[level].tolist() for level in LEVELS},
+        }, f)
+
+    os.rename(building, path)
+    return path
+
+
+def make_current(directory, version):
+    current = os.path.join(directory, '.CURRENT')
+    with open(current, 'w') as f:
+        f.write(str(version))
+    os.replace(current, os.path.join(directory, 'CURRENT'))
+
+    # readers may still have an older version mapped; unlinking doesn't disturb them
+    versions = sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(directory, str(old)), ignore_errors=True)
+    return os.path.join(directory, str(version))
+
+
+class Snapshot:
+    # one version of a snapshot directory. the matrices are memory-mapped the first time they're asked for
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'regions.json')) as f:
+            self.index = json.load(f)
+        self.days = np.datetime_as_string(np.load(os.path.join(path, 'days.npy')))
+        self.rows = {level: {ref_id: row for row, ref_id in enumerate(refs)} for level, refs in self.index['refs'].items()}
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    def matrix(self, level, metric):
+        key = (level, metric)
+        if key not in self._matrices:
+            with self._lock:
+                if key not in self._matrices:
+                    self._matrices[key] = np.load(
+                        os.path.join(self.path, '{}.{}.npy'.format(*key)), mmap_mode='r'
+                    )
+        return self._matrices[key]
+
+    def columns(self, level, ref_id):
+        # the region's ISO days and a float array per metric, NaN where there's no value
+        row = self.rows[level].get(ref_id)
+        if row is None:
+            return [], {metric: np.array([]) for metric in METRICS}
+        present = self.matrix(level, 'cases')[row] != MISSING
+        columns = {}
+        for metric in METRICS:
+            values = np.asarray(self.matrix(level, metric)[row])[present].astype(float)
+            values[values == MISSING] = np.nan
+            columns[metric] = values
+        return self.days[present].tolist(), columns
+
+    def hierarchy(self):
+        # (id, name) countries, (id, name, country) subdivisions and (id, name, subdivision) counties, for a RegionIndex
+        return tuple([tuple(row) for row in self.index[level]] for level in ('countries', 'subdivisions', 'counties'))
+
+    def default_country(self):
+        return self.index['default_country']
+
+
+class SnapshotReader:
+    def __init__(self, directory):
+        self.directory = directory
+        self._snapshot = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def current_version(self):
+        with open(os.path.join(self.directory, 'CURRENT')) as f:
+            return int(f.read().strip())
+
+    def get(self, version):
+        # the snapshot for version, kept open until another one is asked for
+        with self._lock:
+            if version != self._version:
+                self._snapshot = Snapshot(os.path.join(self.directory, str(version)))
+                self._version = version
+            return self._snapshot
@@ -0,0 +1,90 @@
+import datetime
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import app
+import figures
+import transforms
+
+
+ROWS = [
+    ('country', 1, 'US', None),
+    ('country', 2, 'Canada', None),
+    ('subdivision', 10, 'New York', 1),
+]
+# the rollup, as SELECT_ROLLUP_BATCH returns it: level, ref_id, day, cases, deaths, recovered
+ROLLUP = {
+    ('world', 0): [(22, 1, 0, 0), (23, 3, 0, 0), (24, 6, 1, 0), (25, 10, 1, 1)],
+    ('country', 1): [(23, 2, 0, 0), (24, 4, 1, 0)],
+    ('country', 2): [(22, 1, 0, 0), (25, 2, 0, 1)],
+}
+
+
+def day(n):
+    return datetime.date(2020, 1, n)
+
+
+class SeriesTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        patcher = mock.patch.object(app.db, 'query', side_effect=self.query)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app.data_cache.clear()
+        self.addCleanup(app.data_cache.clear)
+
+    def query(self, sql, params=None):
+        # a database holding ROWS and ROLLUP at version 1
+        if sql == app.DATA_VERSION:
+            return [(1,)]
+        if sql == app.REGION_HIERARCHY:
+            return ROWS
+        if sql == app.SELECT_ROLLUP_BATCH:
+            wanted = list(zip(params['levels'], params['ref_ids']))
+            self.batches.append(wanted)
+            return [
+                (level, ref_id, day(n)) + tuple(values)
+                for level, ref_id in sorted(wanted) for n, *values in ROLLUP.get((level, ref_id), [])
+            ]
+        raise AssertionError('unexpected query {}'.format(sql))
+
+    def test_batch_merges_cache_hits_and_misses(self):
+        cached = app.get_series_batch([('country', 1)])
+        self.assertEqual(self.batches, [[('country', 1)]])
+        series = app.get_series_batch([('world', 0), ('country', 1), ('country', 2)])
+        # only what wasn't cached is fetched, in one query
+        self.assertEqual(self.batches[1], [('world', 0), ('country', 2)])
+        self.assertIs(series[('country', 1)], cached[('country', 1)])
+        self.assertEqual(series[('country', 2)][0], ['2020-01-22', '2020-01-25'])
+        np.testing.assert_array_equal(series[('world', 0)][1]['cases'], [1, 3, 6, 10])
+        # and everything's cached now
+        app.get_series_batch([('world', 0), ('country', 2)])
+        self.assertEqual(len(self.batches), 2)
+
+    def test_region_without_series(self):
+        days, columns = app.get_series_batch([('subdivision', 10)])[('subdivision', 10)]
+        self.assertEqual(days, [])
+        self.assertEqual(len(columns['cases']), 0)
+
+    def test_comparison_lines_up_days(self):
+        days, traces = app.comparison_traces(['country:1', 'country:2', 'world:0'], 'linear', 'cases')
+        self.assertEqual(days, ['2020-01-22', '2020-01-23', '2020-01-24', '2020-01-25'])
+        self.assertEqual([label for label, _ in traces], ['US', 'Canada', 'World'])
+        # each region's values on its own days, null where it has none
+        self.assertEqual([figures.compact(y) for _, y in traces], [
+            [None, 2, 4, None],
+            [1, None, None, 2],
+            [1, 3, 6, 10],
+        ])
+
+    def test_comparison_transforms_each_region_on_its_own_days(self):
+        _, traces = app.comparison_traces(['country:2', 'world:0'], 'derivative', 'cases')
+        # Canada's derivative runs over its two days, as if they were consecutive, and leaves the days between null
+        averages = transforms.moving_average(np.array([1., 2.]), app.MOVING_AVERAGE_WINDOW)
+        self.assertEqual(figures.compact(traces[0][1]), [None, None, None, averages[1] - averages[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,350 @@
+import fnmatch
+import os
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import cache
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections.append(self.connection)
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.server.commands.append(args)
+            self.wfile.write(self.server.reply(args))
+
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    # a stand-in for Redis: just the commands RedisCache sends, with SCAN paging through the keys COUNT at a time.
+    # like Redis's, its cursor still finds every remaining key when keys are deleted between pages
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RESPHandler)
+        self.data = {}
+        self.order = []
+        self.expiry = {}
+        self.commands = []
+        self.connections = []
+
+    def drop_connections(self):
+        for connection in self.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+        self.connections = []
+
+    def reply(self, args):
+        command = args[0].upper()
+        if command == b'SELECT':
+            return b'+OK\r\n'
+        if command == b'GET':
+            return bulk(self.data.get(args[1]))
+        if command == b'SET':
+            if args[1] not in self.data:
+                self.order.append(args[1])
+            self.data[args[1]] = args[2]
+            self.expiry[args[1]] = int(args[4]) if len(args) > 4 and args[3].upper() == b'EX' else None
+            return b'+OK\r\n'
+        if command == b'DEL':
+            deleted = [key for key in args[1:] if self.data.pop(key, None) is not None]
+            return b':%d\r\n' % len(deleted)
+        if command == b'SCAN':
+            start, count = int(args[1]), int(args[5])
+            page = [
+                key for key in self.order[start:start + count]
+                if key in self.data and fnmatch.fnmatchcase(key.decode(), args[3].decode())
+            ]
+            cursor = start + count if start + count < len(self.order) else 0
+            return b'*2\r\n' + bulk(str(cursor).encode()) + b'*%d\r\n' % len(page) + b''.join(map(bulk, page))
+        return b'-ERR unknown command\r\n'
+
+
+def bulk(value):
+    return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class LRUCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(cache.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = cache.LRUCache(maxsize=3, ttl=60)
+
+    def test_evicts_least_recently_used(self):
+        for key in 'abc':
+            self.cache.set(key, key.upper())
+        # reading a makes b the least recently used
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.cache.set('d', 'D')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual([self.cache.get(key) for key in 'acd'], ['A', 'C', 'D'])
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual((self.cache.hits, self.cache.misses), (4, 1))
+
+    def test_expiry(self):
+        self.cache.set('key', 'value')
+        self.now += 60
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.now += 1
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_clear(self):
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key'))
+
+
+class VersionStampTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(cache.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.versions = [1]
+        self.loads = 0
+        # like the app's: a per-worker cache is cleared when the version moves
+        self.data_cache = cache.LRUCache()
+        self.stamp = cache.VersionStamp(self.load, interval=30, on_change=lambda version: self.data_cache.clear())
+
+    def load(self):
+        self.loads += 1
+        version = self.versions[0]
+        if isinstance(version, Exception):
+            raise version
+        return version
+
+    def test_checks_every_interval(self):
+        self.assertEqual(self.stamp.get(), 1)
+        self.versions[0] = 2
+        self.now += 29
+        self.assertEqual(self.stamp.get(), 1)
+        self.assertEqual(self.loads, 1)
+        self.now += 1
+        self.assertEqual(self.stamp.get(), 2)
+        self.assertEqual(self.loads, 2)
+
+    def test_on_change_only_when_the_version_moves(self):
+        self.stamp.get()
+        self.data_cache.set('1:columns:world:0', 'series')
+        # the first load and a check that finds the same version leave the cache alone
+        self.now += 30
+        self.stamp.get()
+        self.assertEqual(self.data_cache.get('1:columns:world:0'), 'series')
+        self.versions[0] = 2
+        self.now += 30
+        self.assertEqual(self.stamp.get(), 2)
+        self.assertIsNone(self.data_cache.get('1:columns:world:0'))
+
+    def test_load_failing(self):
+        self.stamp.get()
+        self.versions[0] = RuntimeError('database down')
+        self.now += 30
+        with self.assertRaises(RuntimeError):
+            self.stamp.get()
+        # a failed check isn't counted as one, so the next call tries again rather than waiting out the interval
+        self.versions[0] = 2
+        self.assertEqual(self.stamp.get(), 2)
+        self.assertEqual(self.loads, 3)
+
+
+class SQLiteCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='covid-cache-')
+        self.path = os.path.join(self.directory, 'cache.db')
+        self.now = 1000.0
+        patcher = mock.patch.object(cache.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = cache.SQLiteCache(self.path, maxsize=10, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.cache.set('1:columns:country:3', (['2020-01-22'], {'cases': [1.0]}))
+        self.assertEqual(self.cache.get('1:columns:country:3'), (['2020-01-22'], {'cases': [1.0]}))
+
+    def test_shared_by_version(self):
+        # another worker opening the file sees the same entries; a new data version's keys miss until fetched
+        self.cache.set('1:columns:country:3', 'old')
+        other = cache.SQLiteCache(self.path, maxsize=10, ttl=60)
+        self.assertEqual(other.get('1:columns:country:3'), 'old')
+        self.assertIsNone(other.get('2:columns:country:3'))
+        other.set('2:columns:country:3', 'new')
+        self.assertEqual(self.cache.get('1:columns:country:3'), 'old')
+        self.assertEqual(self.cache.get('2:columns:country:3'), 'new')
+
+    def test_expiry(self):
+        self.cache.set('key', 'value')
+        self.now += 59
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.now += 1
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_purge_evicts_the_oldest(self):
+        self.cache = cache.SQLiteCache(self.path, maxsize=10, ttl=3600)
+        for n in range(cache.SQLiteCache.PURGE_EVERY - 1):
+            self.now += 1
+            self.cache.set(str(n), n)
+        # nothing is purged until the PURGE_EVERY'th set
+        self.assertEqual(self.cache.get('0'), 0)
+        self.now += 1
+        self.cache.set('last', 'last')
+        count = self.cache._connect().execute('SELECT COUNT(*) FROM cache;').fetchone()[0]
+        self.assertEqual(count, 10)
+        self.assertIsNone(self.cache.get('0'))
+        self.assertEqual(self.cache.get('last'), 'last')
+        self.assertEqual(self.cache.get(str(cache.SQLiteCache.PURGE_EVERY - 10)), cache.SQLiteCache.PURGE_EVERY - 10)
+
+    def test_connection_per_thread_and_process(self):
+        connection = self.cache._connect()
+        self.assertIs(self.cache._connect(), connection)
+        others = []
+        thread = threading.Thread(target=lambda: others.append(self.cache._connect()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], connection)
+        # a forked worker can't use its parent's connection
+        with mock.patch.object(cache.os, 'getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(self.cache._connect(), connection)
+
+    def test_clear(self):
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_from_url(self):
+        sqlite = cache.from_url('sqlite://' + self.path, maxsize=5, ttl=30)
+        self.assertEqual((sqlite.path, sqlite.maxsize, sqlite.ttl, sqlite.shared), (self.path, 5, 30, True))
+
+
+class RedisCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RESPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.cache = cache.RedisCache(*self.server.server_address, ttl=60, timeout=2)
+
+    def tearDown(self):
+        self.cache._close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.cache.set('1:columns:country:3', (['2020-01-22'], {'cases': [1.0]}))
+        self.assertEqual(self.cache.get('1:columns:country:3'), (['2020-01-22'], {'cases': [1.0]}))
+        self.assertIn(b'covid:1:columns:country:3', self.server.data)
+        self.assertEqual(self.server.expiry[b'covid:1:columns:country:3'], 60)
+
+    def test_clear_pages_through_prefixed_keys(self):
+        for n in range(1200):
+            self.cache.set(str(n), n)
+        self.server.reply([b'SET', b'other:1', b'kept'])
+        self.cache.clear()
+        self.assertEqual(list(self.server.data), [b'other:1'])
+        self.assertGreater(sum(1 for args in self.server.commands if args[0] == b'SCAN'), 1)
+
+    def test_selects_db(self):
+        redis = cache.RedisCache(*self.server.server_address, db=2)
+        try:
+            redis.get('x')
+        finally:
+            redis._close()
+        self.assertIn([b'SELECT', b'2'], self.server.commands)
+
+    def test_reconnects_after_dropped_connection(self):
+        self.cache.set('key', 'value')
+        self.server.drop_connections()
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_server_errors(self):
+        with self.assertRaises(cache.RedisError):
+            self.cache.command('NOPE')
+        # the connection is still usable afterwards
+        self.cache.set('key', 1)
+        self.assertEqual(self.cache.get('key'), 1)
+
+    def test_from_url(self):
+        redis = cache.from_url('redis://example:6380/3', ttl=30)
+        self.assertEqual((redis.address, redis.db, redis.ttl, redis.shared), (('example', 6380), 3, 30, True))
+
+
+class SingleFlightTest(unittest.TestCase):
+    def run_together(self, threads, target):
+        results = [None] * threads
+        errors = [None] * threads
+
+        def run(n):
+            try:
+                results[n] = target()
+            except Exception as e:
+                errors[n] = e
+
+        workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(5)
+        return results, errors
+
+    def test_coalesces_concurrent_calls(self):
+        flight = cache.SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def fetch(key):
+            calls.append(key)
+            release.wait(5)
+            return key.upper()
+
+        # the first thread holds the call open until the rest are waiting on it
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results, errors = self.run_together(10, lambda: flight.do('a', fetch, 'a'))
+        timer.cancel()
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(errors, [None] * 10)
+        self.assertEqual(sorted(results), [('A', False)] + [('A', True)] * 9)
+
+    def test_shares_errors_and_forgets_the_call(self):
+        flight = cache.SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError('down')
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        _, errors = self.run_together(5, lambda: flight.do('a', fail))
+        timer.cancel()
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+        # nothing in flight any more, so the next call runs afresh
+        self.assertEqual(flight.do('a', lambda: 1), (1, False))
+
+    def test_different_keys_run_separately(self):
+        flight = cache.SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 1), (1, False))
+        self.assertEqual(flight.do('b', lambda: 2), (2, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import unittest
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# a database to connect to; nothing is written to it
+TEST_DSN = os.environ.get('COVID_TEST_DSN')
+
+TERMINATE_OTHERS = '''
+SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+WHERE  datname = current_database() AND pid <> pg_backend_pid();
+'''
+
+
+@unittest.skipUnless(psycopg2 and TEST_DSN, 'needs psycopg2 and a database in $COVID_TEST_DSN')
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        import db
+
+        self.db = db
+        self.settings = os.environ.get('COVID_DSN'), db.POOL_MIN, db.POOL_MAX, db.RETRIES
+        os.environ['COVID_DSN'] = TEST_DSN
+        db.POOL_MIN = db.POOL_MAX = 4
+        db.RETRIES = 1
+        db._pool = db._slots = None
+
+    def tearDown(self):
+        dsn, self.db.POOL_MIN, self.db.POOL_MAX, self.db.RETRIES = self.settings
+        if dsn is None:
+            os.environ.pop('COVID_DSN', None)
+        else:
+            os.environ['COVID_DSN'] = dsn
+        if self.db._pool is not None:
+            self.db._pool.closeall()
+        self.db._pool = self.db._slots = None
+
+    def restart(self):
+        # what a restart does to the pool: every connection it holds dies at once, and each only finds out when used
+        conn = psycopg2.connect(TEST_DSN)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(TERMINATE_OTHERS)
+        conn.close()
+
+    def test_query(self):
+        self.assertEqual(self.db.query('SELECT %s + 1;', [1]), [(2,)])
+
+    def test_survives_restart(self):
+        # the pool opens POOL_MIN connections up front, all of them dead after the restart
+        self.assertEqual(len(self.db.get_pool()._pool), 4)
+        self.restart()
+        for n in range(8):
+            self.assertEqual(self.db.query('SELECT %s;', [n]), [(n,)])
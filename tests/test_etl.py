@@ -0,0 +1,170 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import etl
+from benchmarks import generate
+
+
+class MemoryResolver(etl.DimensionResolver):
+    # DimensionResolver with ids handed out in memory instead of inserted
+    def __init__(self):
+        self.countries = {}
+        self.subdivisions = {}
+        self.counties = {}
+
+    def _insert(self, insert, select, ids, keys, to_key):
+        for key in sorted(set(keys)):
+            ids.setdefault(key, len(ids) + 1)
+
+
+def ordered(long_form):
+    columns = ['country', 'subdivision', 'county', 'day']
+    return long_form.sort_values(columns).reset_index(drop=True)[etl.CASES_COLUMNS]
+
+
+class StreamTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # the blank deaths day and the provinces recovered has no rows for are the cases streaming has to match
+        cls.source_dir = tempfile.mkdtemp(prefix='covid-test-')
+        generate.generate(cls.source_dir, countries=15, provinces=3, states=3, counties=4, days=70)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.source_dir, ignore_errors=True)
+
+    def eager(self, resolver, us, dates):
+        cases = etl.read_cases(us=us, dates=dates, source_dir=self.source_dir)
+        return etl.transform(us, dates, resolver.resolve(cases, us=us), source_dir=self.source_dir)
+
+    def streamed(self, resolver, us, dates, chunksize):
+        staged = []
+
+        def stage(cur, long_form):
+            staged.append(long_form)
+            return len(long_form)
+
+        original = etl.stage
+        etl.stage = stage
+        try:
+            rows = etl.stream_source(None, resolver, us, dates, chunksize=chunksize, source_dir=self.source_dir)
+        finally:
+            etl.stage = original
+        self.assertEqual(rows, sum(len(long_form) for long_form in staged))
+        return pd.concat(staged)
+
+    def test_matches_transform(self):
+        for us in (False, True):
+            dates = etl.get_new_dates(None, us=us, full=True, source_dir=self.source_dir)
+            for chunksize in (1, 7, 1000):
+                with self.subTest(us=us, chunksize=chunksize):
+                    resolver = MemoryResolver()
+                    expected = ordered(self.eager(resolver, us, dates))
+                    actual = ordered(self.streamed(resolver, us, dates, chunksize))
+                    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    def test_counts_nullable(self):
+        frame = pd.DataFrame({'a': pd.array([1, None], dtype=etl.COUNT_DTYPE), 'b': [2.0, None]})
+        values = etl.counts(frame)
+        self.assertEqual(values.dtype, float)
+        self.assertEqual(values[0].tolist(), [1.0, 2.0])
+        self.assertTrue(pd.isnull(values[1]).all())
+
+
+class TransformTest(unittest.TestCase):
+    # known values from the generated files, rather than one load path checked against the other
+    DAYS = 70
+
+    @classmethod
+    def setUpClass(cls):
+        cls.source_dir = tempfile.mkdtemp(prefix='covid-test-')
+        generate.generate(cls.source_dir, countries=10, provinces=3, states=2, counties=3, days=cls.DAYS)
+        cls.resolver = MemoryResolver()
+        cls.long_form = {}
+        for us in (False, True):
+            dates = etl.get_new_dates(None, us=us, full=True, source_dir=cls.source_dir)
+            cases = etl.read_cases(us=us, dates=dates, source_dir=cls.source_dir)
+            ids = cls.resolver.resolve(cases, us=us)
+            cls.long_form[us] = etl.transform(us, dates, ids, source_dir=cls.source_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.source_dir, ignore_errors=True)
+
+    def region(self, country, subdivision=None, county=None):
+        country_id = self.resolver.countries[country]
+        subdivision_id = self.resolver.subdivisions[(subdivision, country_id)] if subdivision else 0
+        county_id = self.resolver.counties[(county, subdivision_id)] if county else 0
+        long_form = self.long_form[country == 'US']
+        rows = long_form.loc[
+            (long_form['country'] == country_id) & (long_form['subdivision'] == subdivision_id) &
+            (long_form['county'] == county_id)
+        ]
+        return rows.sort_values('day').reset_index(drop=True)
+
+    def test_counts(self):
+        # 'Country 0' is the second global row, after the US
+        rows = self.region('Country 0')
+        cases = generate.curve(0, 1, self.DAYS, 20000)
+        self.assertEqual(len(rows), self.DAYS)
+        self.assertEqual(rows['day'].iloc[0], pd.Timestamp(generate.START))
+        self.assertEqual(rows['positive_cases'].tolist(), cases.tolist())
+        self.assertEqual(rows['recovered'].tolist(), (cases // 3).tolist())
+        blank = generate.BLANK_DEATHS_DAY
+        self.assertEqual(rows['deaths'].tolist()[:blank], (cases // 20)[:blank].tolist())
+
+    def test_blank_deaths_day(self):
+        blank = pd.Timestamp(generate.START + datetime.timedelta(days=generate.BLANK_DEATHS_DAY))
+        for us in (False, True):
+            deaths = self.long_form[us].loc[self.long_form[us]['day'] == blank, 'deaths']
+            self.assertTrue(len(deaths))
+            self.assertTrue((deaths == etl.DEATHS_FILL_VALUE).all())
+
+    def test_provinces_without_recovered(self):
+        # every tenth country's provinces have a country total in the recovered file instead of rows of their own
+        rows = self.region('Country 9', 'Province 0')
+        self.assertEqual(len(rows), self.DAYS)
+        self.assertTrue((rows['recovered'] == etl.RECOVERED_FILL_VALUE).all())
+        self.assertTrue((rows['positive_cases'] > 0).any())
+        # while the other split countries' provinces have theirs
+        self.assertTrue((self.region('Country 4', 'Province 0')['recovered'] > 0).any())
+
+    def test_us_rows(self):
+        # the US comes from its own file: the global file's US row isn't loaded
+        us = self.resolver.countries['US']
+        self.assertFalse((self.long_form[False]['country'] == us).any())
+        self.assertTrue((self.long_form[True]['country'] == us).all())
+        # the cruise ships have no county, and load as the placeholder county 0 of their subdivision
+        ships = self.region('US', 'Grand Princess')
+        self.assertEqual(len(ships), self.DAYS)
+        self.assertTrue((ships['county'] == 0).all())
+        self.assertTrue(np.array_equal(
+            self.region('US', 'State 0', 'County 1')['positive_cases'].values,
+            generate.curve(1, len(generate.BOROUGHS) + 1, self.DAYS, 2000)
+        ))
+        self.assertTrue((self.region('US', 'State 0', 'County 1')['recovered'] == etl.RECOVERED_FILL_VALUE).all())
+
+    def test_row_ranges(self):
+        # a worker's share of the rows transforms to its share of the whole file's rows
+        for us in (False, True):
+            dates = etl.get_new_dates(None, us=us, full=True, source_dir=self.source_dir)
+            ids = self.resolver.resolve(etl.read_cases(us=us, source_dir=self.source_dir), us=us)
+            count = len(etl.read_time_series('confirmed', us=us, dates=dates, source_dir=self.source_dir))
+            for chunks in (1, 3, count):
+                with self.subTest(us=us, chunks=chunks):
+                    ranges = etl.row_chunks(count, chunks)
+                    self.assertEqual([start for start, _ in ranges[1:]], [stop for _, stop in ranges[:-1]])
+                    self.assertEqual((ranges[0][0], ranges[-1][1]), (0, count))
+                    long_form = pd.concat([
+                        etl.transform(us, dates, ids, source_dir=self.source_dir, rows=rows) for rows in ranges
+                    ])
+                    pd.testing.assert_frame_equal(ordered(long_form), ordered(self.long_form[us]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import types
+import unittest
+
+import flask
+
+import http_cache
+
+
+class HTTPCacheTest(unittest.TestCase):
+    def setUp(self):
+        # just the parts of a Dash app install uses, with a stand-in for its callback endpoint
+        server = flask.Flask(__name__)
+        app = types.SimpleNamespace(server=server, config=types.SimpleNamespace(routes_pathname_prefix='/'))
+        self.version = 1
+        self.calls = 0
+
+        @server.route('/_dash-update-component', methods=['POST'])
+        def update_component():
+            self.calls += 1
+            return flask.Response(json.dumps({'response': 'x' * 1000}), mimetype='application/json')
+
+        http_cache.install(app, lambda: self.version, {'covid-graph.figure'}, max_age=60, build='build')
+        self.client = server.test_client()
+
+    def post(self, output='covid-graph.figure', value='US', **headers):
+        body = {'output': output, 'inputs': [{'id': 'country-dropdown', 'property': 'value', 'value': value}]}
+        return self.client.post('/_dash-update-component', json=body, headers=headers)
+
+    def test_cache_headers(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        etag, weak = response.get_etag()
+        self.assertTrue(etag)
+        self.assertTrue(weak)
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=60')
+        self.assertIn('Accept-Encoding', response.vary)
+        # the same request has the same ETag; different inputs don't
+        self.assertEqual(self.post().get_etag()[0], etag)
+        self.assertNotEqual(self.post(value='Canada').get_etag()[0], etag)
+
+    def test_not_modified_without_running_the_callback(self):
+        etag = self.post().get_etag()[0]
+        response = self.post(**{'If-None-Match': 'W/"{}"'.format(etag)})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_etag()[0], etag)
+        self.assertEqual(self.calls, 1)
+
+    def test_new_version_changes_the_etag(self):
+        etag = self.post().get_etag()[0]
+        self.version = 2
+        response = self.post(**{'If-None-Match': 'W/"{}"'.format(etag)})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+        self.assertEqual(self.calls, 2)
+
+    def test_nondeterministic_outputs_are_left_alone(self):
+        response = self.post(output='compare-dropdown.options')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_etag(), (None, None))
+        self.assertNotIn('Cache-Control', response.headers)
+
+    @unittest.skipUnless(http_cache.brotli, 'needs brotli')
+    def test_brotli(self):
+        response = self.post(**{'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(
+            json.loads(http_cache.brotli.decompress(response.get_data())), {'response': 'x' * 1000}
+        )
+        self.assertNotIn('Content-Encoding', self.post(**{'Accept-Encoding': 'gzip'}).headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
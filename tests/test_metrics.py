@@ -0,0 +1,106 @@
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import metrics
+
+
+def registry_metrics(registry):
+    return (
+        metrics.Counter('requests_total', 'Requests.', ['path'], registry=registry),
+        metrics.Histogram('request_seconds', 'Latency.', buckets=(1, 2), registry=registry),
+        metrics.Gauge('workers', 'Workers.', registry=registry),
+    )
+
+
+class RegistryTest(unittest.TestCase):
+    def test_render(self):
+        registry = metrics.Registry()
+        counter, histogram, gauge = registry_metrics(registry)
+        counter.inc('/')
+        counter.inc('/', amount=2)
+        histogram.observe(1.5)
+        gauge.set(4)
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{path="/"} 3',
+            '# HELP request_seconds Latency.',
+            '# TYPE request_seconds histogram',
+            'request_seconds_bucket{le="1"} 0',
+            'request_seconds_bucket{le="2"} 1',
+            'request_seconds_bucket{le="+Inf"} 1',
+            'request_seconds_sum 1.5',
+            'request_seconds_count 1',
+            '# HELP workers Workers.',
+            '# TYPE workers gauge',
+            'workers 4',
+        ])
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+
+class MultiprocessTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='covid-metrics-')
+        self.registry = metrics.Registry(self.directory)
+        self.counter, self.histogram, _ = registry_metrics(self.registry)
+
+    def tearDown(self):
+        atexit.unregister(self.registry.flush)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def other_worker(self, pid, started, path, seconds):
+        # another process's registry, as it writes it out
+        other = metrics.Registry()
+        counter, histogram, _ = registry_metrics(other)
+        counter.inc(path)
+        histogram.observe(seconds)
+        with open(os.path.join(self.directory, '{}-{}.json'.format(pid, started)), 'w') as f:
+            json.dump(other.values(), f)
+
+    def test_render_sums_every_process(self):
+        self.counter.inc('/')
+        self.histogram.observe(0.5)
+        self.other_worker(1, 1, '/', 1.5)
+        self.other_worker(2, 1, '/other', 3)
+        # this process's file is stale; what it has now is what's reported
+        with open(self.registry.path(), 'w') as f:
+            json.dump({'requests_total': [[['/'], 100]]}, f)
+        with open(os.path.join(self.directory, 'not-a-worker.json'), 'w') as f:
+            f.write('{')
+        lines = self.registry.render().splitlines()
+        self.assertIn('requests_total{path="/"} 2', lines)
+        self.assertIn('requests_total{path="/other"} 1', lines)
+        self.assertIn('request_seconds_bucket{le="1"} 1', lines)
+        self.assertIn('request_seconds_bucket{le="2"} 2', lines)
+        self.assertIn('request_seconds_sum 5.0', lines)
+        self.assertIn('request_seconds_count 3', lines)
+
+    def test_reused_pid(self):
+        # a worker that exited, and a later one given its pid, both count
+        self.other_worker(1, 1, '/', 1)
+        self.other_worker(1, 2, '/', 1)
+        self.assertIn('requests_total{path="/"} 2', self.registry.render().splitlines())
+
+    def test_changes_are_written_out(self):
+        self.counter.inc('/')
+        path = self.registry.path()
+        deadline = time.time() + 5
+        while not os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.05)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['requests_total'], [[['/'], 1]])
+        # a worker that forked from this one would see the same values in the file under its own pid
+        reader = metrics.Registry(self.directory)
+        registry_metrics(reader)
+        os.rename(path, os.path.join(self.directory, '1-0.json'))
+        self.assertIn('requests_total{path="/"} 1', reader.render().splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
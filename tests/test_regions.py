@@ -0,0 +1,65 @@
+import unittest
+
+import regions
+
+
+ROWS = [
+    ('country', 1, 'US', None),
+    ('country', 2, 'Canada', None),
+    ('country', 3, 'New Zealand', None),
+    ('subdivision', 10, 'New York', 1),
+    ('subdivision', 11, 'Texas', 1),
+    ('subdivision', 12, 'Ontario', 2),
+    ('subdivision', 13, 'Orphan', 99),
+    ('county', 100, 'New York', 10),
+    ('county', 101, 'Albany', 10),
+    ('county', 102, 'Harris', 11),
+    ('county', 103, 'York', 12),
+    ('county', 104, 'Nowhere', 999),
+]
+
+
+class RegionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = regions.RegionIndex.from_rows(ROWS)
+
+    def test_dropdowns(self):
+        self.assertEqual(self.index.countries(), [(2, 'Canada'), (3, 'New Zealand'), (1, 'US')])
+        self.assertEqual(self.index.subdivisions(1), [(10, 'New York'), (11, 'Texas')])
+        self.assertEqual(self.index.counties(10), [(101, 'Albany'), (100, 'New York')])
+        self.assertEqual(self.index.subdivisions(3), [])
+        self.assertEqual(self.index.counties(None), [])
+
+    def test_labels(self):
+        self.assertEqual(self.index.label('country', 1), 'US')
+        self.assertEqual(self.index.label('subdivision', 12), 'Ontario, Canada')
+        self.assertEqual(self.index.label('county', 101), 'Albany, New York, US')
+        # parents that aren't in the index leave the region with its own name
+        self.assertEqual(self.index.label('subdivision', 13), 'Orphan')
+        self.assertEqual(self.index.label('county', 104), 'Nowhere')
+        self.assertIsNone(self.index.label('county', 5))
+        labels = [label for _, _, label in self.index.regions()]
+        self.assertEqual(labels, sorted(labels))
+        self.assertEqual(len(labels), len(ROWS))
+
+    def test_search_ranks_prefix_then_word_then_substring(self):
+        found = [(level, region_id) for level, region_id, _ in self.index.search('york')]
+        # "York, Ontario, Canada" starts with it; the New Yorks have a word that does
+        self.assertEqual(found[0], ('county', 103))
+        self.assertEqual(set(found[1:]), {('subdivision', 10), ('county', 100), ('county', 101)})
+        self.assertEqual(
+            [label for _, _, label in self.index.search('ntari')], ['Ontario, Canada', 'York, Ontario, Canada']
+        )
+
+    def test_search_is_case_insensitive_and_limited(self):
+        self.assertEqual(
+            [label for _, _, label in self.index.search('  NEW ')],
+            ['New York, New York, US', 'New York, US', 'New Zealand', 'Albany, New York, US'],
+        )
+        self.assertEqual(len(self.index.search('', limit=3)), 3)
+        self.assertEqual(len(self.index.search('e', limit=5)), 5)
+        self.assertEqual(self.index.search('zzz'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import regions
+import snapshot
+
+
+# the rollup's rows by level, as COPY_SERIES writes them: ref_id, day, cases, deaths, recovered. a blank is a NULL
+SERIES = {
+    'world': [
+        '0,2020-01-22,1,0,0', '0,2020-01-23,3,0,0', '0,2020-01-24,6,1,',
+    ],
+    'country': [
+        '1,2020-01-23,2,0,0', '1,2020-01-24,4,1,',
+        '2,2020-01-22,1,0,0', '2,2020-01-23,1,0,0', '2,2020-01-24,2,0,1',
+    ],
+    'subdivision': ['10,2020-01-24,3,1,0'],
+    'county': [],
+}
+COUNTRIES = [(2, 'Canada'), (3, 'New Zealand'), (1, 'US')]
+SUBDIVISIONS = [(10, 'New York', 1)]
+COUNTIES = [(100, 'Albany', 10)]
+
+
+class Cursor:
+    # answers the queries write_snapshot makes
+    def __init__(self):
+        self.rows = []
+
+    def mogrify(self, sql, params):
+        return (sql + '--' + params['level']).encode()
+
+    def copy_expert(self, sql, buffer):
+        level = sql.rsplit('--', 1)[1]
+        buffer.write(''.join(line + '\n' for line in SERIES[level]))
+
+    def execute(self, sql, params=None):
+        self.rows = {
+            snapshot.SNAPSHOT_COUNTRIES: COUNTRIES,
+            snapshot.SNAPSHOT_SUBDIVISIONS: SUBDIVISIONS,
+            snapshot.SNAPSHOT_COUNTIES: COUNTIES,
+            snapshot.SNAPSHOT_DEFAULT_COUNTRY: [(1,)],
+        }[sql]
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='covid-snapshot-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def published(self, version=1):
+        snapshot.write_snapshot(Cursor(), self.directory, version)
+        snapshot.make_current(self.directory, version)
+        reader = snapshot.SnapshotReader(self.directory)
+        return reader.get(reader.current_version())
+
+    def test_columns(self):
+        current = self.published()
+        days, columns = current.columns('world', 0)
+        self.assertEqual(days, ['2020-01-22', '2020-01-23', '2020-01-24'])
+        np.testing.assert_array_equal(columns['cases'], [1, 3, 6])
+        np.testing.assert_array_equal(columns['deaths'], [0, 0, 1])
+        # a NULL is stored as MISSING and read back as NaN
+        np.testing.assert_array_equal(columns['recovered'], [0, 0, np.nan])
+        self.assertEqual(columns['recovered'].dtype, float)
+
+        # a region's days are the ones it has, within the shared axis
+        days, columns = current.columns('country', 1)
+        self.assertEqual(days, ['2020-01-23', '2020-01-24'])
+        np.testing.assert_array_equal(columns['cases'], [2, 4])
+        np.testing.assert_array_equal(current.columns('subdivision', 10)[1]['deaths'], [1])
+
+    def test_region_without_series(self):
+        current = self.published()
+        for level, ref_id in (('country', 3), ('county', 100)):
+            days, columns = current.columns(level, ref_id)
+            self.assertEqual(days, [])
+            self.assertEqual(sorted(columns), sorted(snapshot.METRICS))
+            self.assertTrue(all(len(values) == 0 for values in columns.values()))
+
+    def test_hierarchy(self):
+        current = self.published()
+        self.assertEqual(current.default_country(), 1)
+        index = regions.RegionIndex(*current.hierarchy())
+        self.assertEqual(index.countries(), [(2, 'Canada'), (3, 'New Zealand'), (1, 'US')])
+        self.assertEqual(index.subdivisions(1), [(10, 'New York')])
+        self.assertEqual(index.counties(10), [(100, 'Albany')])
+
+    def test_current_only_moves_when_published(self):
+        reader = snapshot.SnapshotReader(self.directory)
+        self.published(1)
+        path = snapshot.write_snapshot(Cursor(), self.directory, 2)
+        self.assertEqual(path, os.path.join(self.directory, '2'))
+        self.assertEqual(reader.current_version(), 1)
+        snapshot.make_current(self.directory, 2)
+        self.assertEqual(reader.current_version(), 2)
+        # written beside CURRENT and renamed over it, nothing's left behind
+        self.assertEqual(sorted(os.listdir(self.directory)), ['1', '2', 'CURRENT'])
+
+    def test_rebuilding_a_version_keeps_it(self):
+        path = snapshot.write_snapshot(Cursor(), self.directory, 1)
+        marker = os.path.join(path, 'marker')
+        open(marker, 'w').close()
+        self.assertEqual(snapshot.write_snapshot(Cursor(), self.directory, 1), path)
+        self.assertTrue(os.path.exists(marker))
+
+    def test_prunes_old_versions(self):
+        for version in range(1, 5):
+            self.published(version)
+        kept = sorted(name for name in os.listdir(self.directory) if name.isdigit())
+        self.assertEqual(kept, [str(version) for version in range(5 - snapshot.KEEP_VERSIONS, 5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+import numpy as np
+
+import figures
+import transforms
+
+
+CASES = transforms.as_array([1, 2, 4, 8, 16, 30, 30, 0])
+# what the materialized tables had for CASES: AVG() OVER (ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) cast to INTEGER,
+# and LAG() differences of those
+SQL_AVERAGES = [1, 2, 2, 5, 9, 18, 25, 20]
+SQL_DERIVATIVES = [None, 1, 0, 3, 4, 9, 7, -5]
+
+
+class TransformsTest(unittest.TestCase):
+    def test_moving_average_matches_sql(self):
+        averages = transforms.moving_average(CASES)
+        np.testing.assert_allclose(averages, [1, 3 / 2, 7 / 3, 14 / 3, 28 / 3, 18, 76 / 3, 20])
+        # the old tables rounded to whole numbers; postgres rounds halves away from zero
+        self.assertEqual(np.floor(averages + 0.5).tolist(), SQL_AVERAGES)
+        np.testing.assert_allclose(transforms.moving_average(CASES, window=1), CASES)
+
+    def test_derivative_matches_sql(self):
+        derivatives = transforms.derivative(CASES)
+        self.assertTrue(np.isnan(derivatives[0]))
+        np.testing.assert_allclose(derivatives[1:], np.diff(transforms.moving_average(CASES)))
+        # within the rounding of the averages the old tables differenced
+        self.assertTrue((np.abs(derivatives[1:] - SQL_DERIVATIVES[1:]) <= 1).all())
+
+    def test_growth_from_zero_is_undefined(self):
+        values = transforms.as_array([0, 0, 0, 3, 6, 12])
+        rates = transforms.log_derivative(values, window=1)
+        self.assertTrue(np.isnan(rates[:4]).all())
+        np.testing.assert_allclose(rates[4:], np.log(2))
+        doubling = transforms.doubling_time(values, window=1)
+        self.assertTrue(np.isnan(doubling[:4]).all())
+        np.testing.assert_allclose(doubling[4:], 1)
+
+    def test_doubling_time_needs_growth(self):
+        # flat and shrinking series have a growth rate, but no doubling time
+        values = transforms.as_array([4, 4, 2, 1])
+        np.testing.assert_allclose(transforms.log_derivative(values, window=1)[1:], [0, -np.log(2), -np.log(2)])
+        self.assertTrue(np.isnan(transforms.doubling_time(values, window=1)).all())
+
+    def test_missing_values(self):
+        values = transforms.as_array([1, None, 4])
+        self.assertTrue(np.isnan(values[1]))
+        # averaged over the days there are, so a missing day only leaves a gap where a whole window is missing
+        np.testing.assert_allclose(transforms.moving_average(values), [1, 1, 2.5])
+        np.testing.assert_allclose(transforms.derivative(values)[1:], [0, 1.5])
+        gaps = transforms.as_array([None, None, 3, None, None, 7, 9])
+        np.testing.assert_allclose(transforms.moving_average(gaps, window=2), [np.nan, np.nan, 3, 3, np.nan, 7, 8])
+        self.assertIs(transforms.apply('linear', values), values)
+        self.assertEqual(len(transforms.apply('doubling-time', transforms.as_array([]))), 0)
+
+
+class FiguresTest(unittest.TestCase):
+    def test_compact(self):
+        self.assertEqual(figures.compact(transforms.as_array([1, 2, 3])), [1, 2, 3])
+        self.assertTrue(all(type(value) is int for value in figures.compact(transforms.as_array([1, 2.0]))))
+        self.assertEqual(figures.compact(transforms.as_array([1, None, 3])), [1, None, 3])
+        self.assertEqual(figures.compact(transforms.as_array([0.5, None, 1 / 3])), [0.5, None, 0.3333])
+        self.assertEqual(figures.compact(transforms.as_array([None, None])), [None, None])
+        self.assertEqual(figures.compact(transforms.as_array([])), [])
+
+    def test_x_values(self):
+        days = ['2020-03-01', '2020-03-02', '2020-03-03']
+        self.assertEqual(figures.x_values(days), {'x0': '2020-03-01', 'dx': figures.DAY})
+        self.assertEqual(figures.x_values(days[:1]), {'x0': '2020-03-01', 'dx': figures.DAY})
+        gap = ['2020-03-01', '2020-03-03', '2020-03-04']
+        self.assertEqual(figures.x_values(gap), {'x': gap})
+        self.assertEqual(figures.x_values([]), {'x': []})
+
+    def test_figure(self):
+        figure = figures.figure(['2020-03-01', '2020-03-02'], [('Cases', transforms.as_array([1, 2]))], 'log')
+        self.assertEqual(
+            figure['data'], [{'x0': '2020-03-01', 'dx': figures.DAY, 'y': [1, 2], 'type': 'line', 'name': 'Cases'}]
+        )
+        self.assertEqual(figure['layout']['yaxis'], {'type': 'log'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import regions
+import warmup
+
+
+ROWS = [
+    ('country', 1, 'US', None),
+    ('country', 2, 'Canada', None),
+    ('subdivision', 10, 'New York', 1),
+    ('county', 100, 'Albany', 10),
+]
+# (level, ref_id) rows as REGIONS_BY_SIZE returns them, largest first
+BY_SIZE = [('country', 1), ('subdivision', 10), ('country', 2), ('county', 100)]
+
+
+class App:
+    # the parts of the app warm-up uses
+    snapshots = None
+
+    def __init__(self, data_cache):
+        self.data_cache = data_cache
+        self.batches = []
+
+    def fetch_default_country(self):
+        return 1
+
+    def fetch_region_index(self):
+        return regions.RegionIndex.from_rows(ROWS)
+
+    def cached(self, name, fetch, version=None):
+        return fetch()
+
+    def get_series_batch(self, wanted, version=None):
+        self.batches.append(list(wanted))
+
+
+class ChooseRegionsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='covid-warmup-')
+        self.app = App(data_cache=None)
+        patcher = mock.patch.object(warmup.db, 'query', return_value=BY_SIZE)
+        self.query = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def request_log(self, *series):
+        path = os.path.join(self.directory, 'requests.log')
+        with open(path, 'w') as f:
+            f.writelines('series {}\n'.format(region) for region in series)
+        return path
+
+    def test_every_region_by_default(self):
+        chosen = warmup.choose_regions(self.app, 7)
+        self.assertEqual(chosen[0], ('world', 0))
+        self.assertEqual(sorted(chosen[1:]), sorted(BY_SIZE))
+        self.query.assert_not_called()
+
+    def test_largest_without_a_request_log(self):
+        self.assertEqual(
+            warmup.choose_regions(self.app, 7, top=4),
+            [('world', 0), ('country', 1), ('subdivision', 10), ('country', 2)]
+        )
+        self.query.assert_called_once_with(warmup.REGIONS_BY_SIZE, {'version': 7})
+
+    def test_most_requested_first(self):
+        log = self.request_log('county:100', 'country:2', 'county:100', 'world:0')
+        self.assertEqual(
+            warmup.choose_regions(self.app, 7, top=5, request_logs=[log]),
+            [('world', 0), ('country', 1), ('county', 100), ('country', 2), ('subdivision', 10)]
+        )
+
+    def test_world_and_default_country_always_included(self):
+        log = self.request_log('county:100', 'county:100', 'country:2')
+        self.assertEqual(
+            warmup.choose_regions(self.app, 7, top=1, request_logs=[log]), [('world', 0), ('country', 1)]
+        )
+
+
+class WarmTest(unittest.TestCase):
+    def warm(self, data_cache, **kwargs):
+        app = App(data_cache)
+        output = io.StringIO()
+        with mock.patch.dict(sys.modules, app=app), mock.patch.object(warmup.db, 'query', return_value=BY_SIZE), \
+                contextlib.redirect_stdout(output):
+            warmed = warmup.warm(7, concurrency=1, **kwargs)
+        return warmed, app, output.getvalue()
+
+    def test_warms_every_region_that_fits(self):
+        warmed, app, output = self.warm(types.SimpleNamespace(shared=True, maxsize=512), batch_size=2)
+        self.assertEqual(warmed, 5)
+        self.assertEqual([len(batch) for batch in app.batches], [2, 2, 1])
+        self.assertNotIn('more than the cache holds', output)
+
+    def test_capped_to_the_cache(self):
+        warmed, app, output = self.warm(types.SimpleNamespace(shared=True, maxsize=4))
+        self.assertEqual(warmed, 3)
+        self.assertEqual(app.batches, [[('world', 0), ('country', 1), ('subdivision', 10)]])
+        self.assertIn('5 regions are more than the cache holds', output)
+
+    def test_per_worker_cache(self):
+        warmed, app, output = self.warm(types.SimpleNamespace(shared=False, maxsize=512))
+        self.assertEqual(warmed, 0)
+        self.assertEqual(app.batches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
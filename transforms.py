@@ -0,0 +1,71 @@
+import numpy as np
+
+
+# transforms of a cumulative daily series, each one pass over the whole array. they take and return float arrays,
+# with NaN on days a value isn't defined (the first day of a derivative, a growth rate from zero cases)
+
+DEFAULT_WINDOW = 3
+
+
+def as_array(values):
+    # None becomes NaN
+    return np.array(values, dtype=float)
+
+
+def trailing_sums(values, window):
+    totals = np.cumsum(values)
+    totals[window:] = totals[window:] - totals[:-window]
+    return totals
+
+
+def moving_average(values, window=DEFAULT_WINDOW):
+    # trailing mean; the first window - 1 days average what there is so far, like
+    # AVG() OVER (ROWS BETWEEN window - 1 PRECEDING AND CURRENT ROW). like AVG() it skips missing days rather than
+    # letting them into every later sum, and is NaN only where a window has none
+    present = ~np.isnan(values)
+    totals = trailing_sums(np.where(present, values, 0), window)
+    counts = trailing_sums(present.astype(float), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+def difference(values):
+    differences = np.full(len(values), np.nan)
+    differences[1:] = np.diff(values)
+    return differences
+
+
+def derivative(values, window=DEFAULT_WINDOW):
+    # new cases per day, smoothed
+    return difference(moving_average(values, window))
+
+
+def log_derivative(values, window=DEFAULT_WINDOW):
+    # daily growth rate: d/dt ln(cases)
+    averages = moving_average(values, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.where(averages > 0, np.log(averages), np.nan)
+    return difference(logs)
+
+
+def doubling_time(values, window=DEFAULT_WINDOW):
+    # days to double at the current growth rate; undefined when nothing's growing
+    rates = log_derivative(values, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(rates > 0, np.log(2) / rates, np.nan)
+
+
+TRANSFORMS = {
+    'moving-average': moving_average,
+    'derivative': derivative,
+    'growth-rate': log_derivative,
+    'doubling-time': doubling_time,
+}
+
+
+def apply(plot_type, values, window=DEFAULT_WINDOW):
+    # plot types without a transform (linear, log) chart the series as it is
+    transform = TRANSFORMS.get(plot_type)
+    if transform is None:
+        return values
+    return transform(values, window)
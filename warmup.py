@@ -0,0 +1,139 @@
+import argparse
+import collections
+import functools
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+
+# fills the app's cache for a data version the ETL has built but not yet published, then publishes it, so that the
+# first visitors after a load find World, the US and the rest already fetched. the cache has to be shared
+# (COVID_CACHE_URL=sqlite:///... or redis://...): a memory:// one lives in each app worker, out of reach. what's
+# cached is each region's cumulative series; every plot type is computed from the series per request, and the
+# dropdowns are served from the region index each worker builds for itself. the ETL runs this as its warm-up stage
+# with --warm-up; it can also be run on its own
+
+# the app serves live_version; the ETL bumps version when it loads
+GET_BUILT_VERSION = '''
+SELECT version FROM data_version;
+'''
+
+PUBLISH_DATA_VERSION = '''
+UPDATE data_version SET live_version = GREATEST(COALESCE(live_version, 0), %s) RETURNING live_version;
+'''
+
+# largest first, by their latest count as of the version being warmed: the regions that get asked for most when
+# there's no request log to go by
+REGIONS_BY_SIZE = '''
+WITH rollup AS (
+    SELECT level, ref_id, day, positive_cases FROM cases_rollup
+    WHERE  version <= %(version)s AND (retired IS NULL OR retired > %(version)s)
+)
+SELECT level, ref_id FROM rollup
+WHERE  day = (SELECT MAX(day) FROM rollup) AND level IN ('country', 'subdivision', 'county') AND ref_id > 0
+ORDER  BY positive_cases DESC, level, ref_id;
+'''
+
+# what the app logs to COVID_REQUEST_LOG for every series a chart asks for
+REQUESTED_SERIES = re.compile(r'series (world|country|subdivision|county):(\d+)')
+
+db.name_queries(globals())
+
+BATCH_SIZE = 50
+
+
+def requested_regions(paths):
+    counts = collections.Counter()
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                match = REQUESTED_SERIES.search(line)
+                if match:
+                    counts[(match.group(1), int(match.group(2)))] += 1
+    return [region for region, _ in counts.most_common()]
+
+
+def choose_regions(app, version, top=None, request_logs=()):
+    # every region, or the top most requested ones (always World and the default country among them)
+    if top is None:
+        return [('world', 0)] + [(level, ref_id) for level, ref_id, _ in app.fetch_region_index().regions()]
+    regions = [('world', 0), ('country', app.fetch_default_country())]
+    ranked = requested_regions(request_logs)
+    ranked.extend(tuple(row) for row in db.query(REGIONS_BY_SIZE, {'version': version}))
+    for region in ranked:
+        if region not in regions:
+            regions.append(region)
+    return regions[:max(top, 2)]
+
+
+def warm(version, top=None, request_logs=(), concurrency=4, batch_size=BATCH_SIZE):
+    # returns the number of regions warmed
+    import app
+
+    if app.snapshots:
+        print('warm-up: the app serves a snapshot, nothing to warm')
+        return 0
+    if not app.data_cache.shared:
+        print('warm-up: the cache is per worker ({}), nothing to warm'.format(type(app.data_cache).__name__))
+        return 0
+
+    regions = choose_regions(app, version, top=top, request_logs=request_logs)
+    maxsize = getattr(app.data_cache, 'maxsize', None)
+    if maxsize is not None and len(regions) > maxsize - 1:
+        # a bounded cache (COVID_CACHE_SIZE) evicts its oldest entries first, and warming more regions than it holds
+        # would push out the first, most wanted ones. one entry goes to the default country
+        print('warm-up: {} regions are more than the cache holds (COVID_CACHE_SIZE={}), warming the {} most '
+              'wanted'.format(len(regions), maxsize, maxsize - 1))
+        regions = choose_regions(app, version, top=maxsize - 1, request_logs=request_logs)
+    tasks = [functools.partial(app.cached, 'default-country', app.fetch_default_country, version=version)]
+    # series a batch at a time, in one query each
+    tasks.extend(
+        functools.partial(app.get_series_batch, regions[start:start + batch_size], version=version)
+        for start in range(0, len(regions), batch_size)
+    )
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        list(executor.map(lambda task: task(), tasks))
+    print('warm-up: {} regions for version {} in {:.2f}s with {} thread{}'.format(
+        len(regions), version, time.perf_counter() - started, concurrency, '' if concurrency == 1 else 's'
+    ))
+    return len(regions)
+
+
+parser = argparse.ArgumentParser(description="Fill the app's cache for the newest data version, then publish it.")
+parser.add_argument(
+    '--version', type=int, help='the data version to warm (default: the newest the ETL has built)'
+)
+parser.add_argument(
+    '--top', type=int, metavar='N',
+    help='warm only the N most requested regions (by --request-log, else the largest) instead of all of them; '
+         'never more than the cache holds ($COVID_CACHE_SIZE)'
+)
+parser.add_argument(
+    '--request-log', action='append', default=[], metavar='PATH',
+    help="a log the app wrote with COVID_REQUEST_LOG, to rank regions by how often they're asked for (default: "
+         '$COVID_REQUEST_LOG, if it exists); repeatable'
+)
+parser.add_argument('--concurrency', type=int, default=4, help='queries in flight at once (default 4)')
+parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='regions per query')
+parser.add_argument('--no-publish', action='store_true', help="warm the cache but don't publish the version")
+
+
+def main():
+    args = parser.parse_args()
+    request_logs = args.request_log
+    if not request_logs and os.path.exists(os.environ.get('COVID_REQUEST_LOG', '')):
+        request_logs = [os.environ['COVID_REQUEST_LOG']]
+    version = args.version if args.version is not None else db.query(GET_BUILT_VERSION)[0][0]
+    warm(version, top=args.top, request_logs=request_logs, concurrency=args.concurrency, batch_size=args.batch_size)
+    if not args.no_publish:
+        live = db.query(PUBLISH_DATA_VERSION, [version])[0][0]
+        print('warm-up: version {} is live'.format(live))
+
+
+if __name__ == '__main__':
+    main()